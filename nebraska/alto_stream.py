@@ -0,0 +1,223 @@
+# Streaming attribute rewriter for ALTO pages
+#
+# ALTO files for large broadsheets reach tens of megabytes, and building a
+# full ElementTree for them costs hundreds of megabytes of Python objects.
+# The rewriter instead feeds the file through expat in chunks and writes each
+# event straight back out, patching attributes as they pass, such as String
+# CONTENT inside PrintSpace when fixing dates.  Namespace processing is left
+# off so prefixes, xmlns declarations and attribute order are written
+# exactly as parsed.  Comments are preserved.
+
+import mmap
+import os
+import shutil
+import tempfile
+from xml.parsers import expat
+
+# Size of each read from the source and of output buffered between writes
+CHUNK_SIZE = 64 * 1024
+
+
+def local_name(name):
+    return name.rsplit(':', 1)[-1]
+
+
+def escape_cdata(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def escape_attrib(text):
+    text = escape_cdata(text)
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    return text
+
+
+class AttributeRewriter(object):
+    # Rewrites attributes matched by (within, tag, attribute, transform)
+    # rules: attribute on elements with local name tag, inside an element
+    # with local name within (or anywhere if within is None), is replaced
+    # by transform(value).  replaced counts the values transform changed.
+
+    def __init__(self, out, rules):
+        self.out = out
+        self.replaced = 0
+
+        self._rules = rules
+        # Open elements of each local name rules look inside
+        self._within_depth = dict((within, 0) for within, _, _, _ in rules
+                                  if within is not None)
+        self.update_transforms()
+
+        self._buffer = []
+        self._buffered = 0
+        self._local_names = {}
+        self._depth = 0
+        # Start tag written without its closing ">" yet, so an element with
+        # no content can still be written as an empty element
+        self._tag_open = False
+
+        parser = expat.ParserCreate()
+        parser.ordered_attributes = 1
+        parser.buffer_text = 1
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.data
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.pi
+        self._parser = parser
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.out.write(u"".join(self._buffer).encode("utf-8"))
+        self._buffer = []
+        self._buffered = 0
+
+    def local_name(self, name):
+        try:
+            return self._local_names[name]
+        except KeyError:
+            tag = self._local_names[name] = local_name(name)
+            return tag
+
+    def update_transforms(self):
+        # Map tag -> {attribute: [transforms]} for the rules that apply at
+        # the current position, rebuilt only on entering or leaving the
+        # elements rules look inside
+        self._transforms = {}
+        for within, tag, attribute, transform in self._rules:
+            if within is None or self._within_depth[within]:
+                attributes = self._transforms.setdefault(tag, {})
+                attributes.setdefault(attribute, []).append(transform)
+
+    def close_tag(self):
+        if self._tag_open:
+            self.write(">")
+            self._tag_open = False
+
+    # Parser events
+    # -------------
+    def start(self, name, attrs):
+        self.close_tag()
+        self._depth += 1
+
+        tag = self.local_name(name)
+        if tag in self._within_depth:
+            self._within_depth[tag] += 1
+            if self._within_depth[tag] == 1:
+                self.update_transforms()
+
+        # Attributes to transform on this element
+        transforms = self._transforms.get(tag)
+
+        parts = ["<", name]
+        for i in range(0, len(attrs), 2):
+            key, value = attrs[i], attrs[i + 1]
+
+            if transforms and key in transforms:
+                for transform in transforms[key]:
+                    new_value = transform(value)
+                    if new_value != value:
+                        value = new_value
+                        self.replaced += 1
+
+            parts.append(" %s=\"%s\"" % (key, escape_attrib(value)))
+
+        self.write("".join(parts))
+        self._tag_open = True
+
+    def end(self, name):
+        if self._tag_open:
+            self.write(" />")
+            self._tag_open = False
+        else:
+            self.write("</%s>" % name)
+
+        if self._within_depth:
+            tag = self.local_name(name)
+            if tag in self._within_depth:
+                self._within_depth[tag] -= 1
+                if not self._within_depth[tag]:
+                    self.update_transforms()
+        self._depth -= 1
+
+    def data(self, text):
+        self.close_tag()
+        self.write(escape_cdata(text))
+
+    def comment(self, text):
+        self.close_tag()
+        self.write("<!--%s-->" % text)
+        if not self._depth:
+            self.write("\n")
+
+    def pi(self, target, text):
+        self.close_tag()
+        self.write("<?%s %s?>" % (target, text))
+        if not self._depth:
+            self.write("\n")
+
+    # Driver
+    # ------
+    def rewrite(self, source):
+        self.write(u"<?xml version='1.0' encoding='UTF-8'?>\n")
+
+        while 1:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self._parser.Parse(chunk, 0)
+
+        self._parser.Parse("", 1)
+        self.flush()
+        return self.replaced
+
+
+def file_contains(file_path, needle):
+    # Byte-level search of the mapped file, without parsing it
+    with open(file_path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return False
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return mapped.find(needle) >= 0
+        finally:
+            mapped.close()
+
+
+def rewrite_attributes(file_path, rules):
+    # Stream file_path through an AttributeRewriter into a temporary file
+    # beside it, moving that into place only if any value was replaced.
+    # Returns the number of values replaced.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path),
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            with open(file_path, "rb") as source:
+                replaced = AttributeRewriter(out, rules).rewrite(source)
+
+        if replaced:
+            shutil.copymode(file_path, temp_path)
+            os.rename(temp_path, file_path)
+        else:
+            os.remove(temp_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+    return replaced
+
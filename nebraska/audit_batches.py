@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import multiprocessing
+import os
+import re
+import time
+from xml.parsers import expat
+
+from batch_index import BatchIndex
+from batchlib import BATCH_ISSUE, MODS_DATE_ISSUED, MODS_IDENTIFIER, \
+    Batch, is_mets_file, issue_path_tail, lccn_dir_re
+
+
+
+# Defaults
+# --------
+search_dir = '/opt/openoni/data/batches'
+
+# Bytes of METS read at a time; the fields audited sit in the first dmdSec
+chunk_size = 16 * 1024
+
+
+
+# Arguments
+# ---------
+parser = argparse.ArgumentParser()
+
+# Optional args
+parser.add_argument("-i", "--index_file",
+                    help="batch index file (default: <search_dir>/.batch_index.sqlite)")
+parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                    help="processes reading METS and batch XML (default: CPU count)")
+parser.add_argument("-l", "--lccn_manifest",
+                    help="write CSV of bad_lccn,correct_lccn,start_date,end_date "
+                         "ranges for fix_lccn_by_date.py")
+parser.add_argument("-m", "--manifest",
+                    help="write CSV of lccn,bad_date,new_date corrections "
+                         "for fix_dates_by_lccn.py --manifest")
+parser.add_argument("-q", "--quiet", action="store_true",
+                    help="suppress output")
+parser.add_argument("-s", "--search_dir",
+                    help="directory to search (default: /batches)")
+parser.add_argument("-v", "--verbose", action="store_true",
+                    help="extra processing information")
+
+# Positional args
+parser.add_argument("lccns", nargs="*", help="LCCNs to audit (default: all)")
+
+args = parser.parse_args()
+
+# Handle optional redefined batch directory
+if args.search_dir:
+    if os.path.exists(args.search_dir): search_dir = args.search_dir
+    else: print "{0} does not exist".format(args.search_dir)
+
+label_date_re = re.compile("[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
+
+
+# Functions
+# ---------
+class _Done(Exception):
+    pass
+
+
+def read_mets_fields(mets_path):
+    # Stream an issue METS file just far enough to find its LABEL and first
+    # mods:identifier and mods:dateIssued, the elements the fix scripts edit
+    fields = {"label": None, "identifier": None, "date_issued": None}
+    tags = {MODS_IDENTIFIER: "identifier", MODS_DATE_ISSUED: "date_issued"}
+    reading = {"field": None, "text": []}
+
+    def start(name, attrs):
+        if fields["label"] is None:
+            # Root element
+            fields["label"] = attrs.get("LABEL", "")
+        field = tags.get("{" + name)
+        if field and fields[field] is None and reading["field"] is None:
+            reading["field"] = field
+            reading["text"] = []
+
+    def data(text):
+        if reading["field"]:
+            reading["text"].append(text)
+
+    def end(name):
+        field = reading["field"]
+        if field and tags.get("{" + name) == field:
+            fields[field] = u"".join(reading["text"]).strip()
+            reading["field"] = None
+            if fields["identifier"] is not None and fields["date_issued"] is not None:
+                raise _Done()
+
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.StartElementHandler = start
+    parser.CharacterDataHandler = data
+    parser.EndElementHandler = end
+
+    with open(mets_path, "rb") as mets:
+        try:
+            while 1:
+                chunk = mets.read(chunk_size)
+                if not chunk:
+                    break
+                parser.Parse(chunk, 0)
+            parser.Parse("", 1)
+        except _Done:
+            pass
+
+    return fields
+
+
+def read_batch_records(batch_path):
+    # Stream batch.xml into {lccn/reel/issue: (lccn, issueDate)}.  Run in a
+    # worker process, returning (batch_path, records, error).
+    records = {}
+    reading = {"attrs": None, "text": []}
+
+    def start(name, attrs):
+        if "{" + name == BATCH_ISSUE:
+            reading["attrs"] = attrs
+            reading["text"] = []
+
+    def data(text):
+        if reading["attrs"] is not None:
+            reading["text"].append(text)
+
+    def end(name):
+        if "{" + name == BATCH_ISSUE:
+            attrs = reading["attrs"]
+            tail = issue_path_tail(u"".join(reading["text"]))
+            records[tail] = (attrs.get("lccn"), attrs.get("issueDate"))
+            reading["attrs"] = None
+
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.StartElementHandler = start
+    parser.CharacterDataHandler = data
+    parser.EndElementHandler = end
+
+    try:
+        with open(os.path.join(batch_path, "batch.xml"), "rb") as batch_xml:
+            parser.ParseFile(batch_xml)
+    except (IOError, expat.ExpatError) as e:
+        return batch_path, records, str(e)
+
+    return batch_path, records, None
+
+
+def issue_mets_path(issue_path):
+    # The issue METS named for its directory, or else its first METS file
+    name = os.path.basename(issue_path)
+    mets_path = os.path.join(issue_path, name + ".xml")
+    if os.path.exists(mets_path):
+        return mets_path
+
+    for f in sorted(os.listdir(issue_path)):
+        if is_mets_file(f) and not f[-6:] == "_1.xml":
+            return os.path.join(issue_path, f)
+    return None
+
+
+def read_issue(job):
+    # Read one issue's METS fields in a worker process, returning
+    # (tail, fields, error)
+    tail, issue_path = job
+
+    try:
+        mets_path = issue_mets_path(issue_path)
+        if mets_path is None:
+            return tail, None, "no issue METS"
+        return tail, read_mets_fields(mets_path), None
+    except (OSError, IOError, expat.ExpatError) as e:
+        return tail, None, str(e)
+
+
+def agreed(values):
+    # The one value all present sources give, or None if they disagree
+    values = set(value for value in values if value)
+    if len(values) == 1:
+        return values.pop()
+    return None
+
+
+def audit_issue(issue, fields, record):
+    # Compare one issue's directory names against its METS and batch XML
+    # record.  Returns (mismatches, new_date, new_lccn) where the new date
+    # or LCCN is set only when every other source agrees on it.
+    mismatches = []
+    record_lccn, record_date = record or (None, None)
+
+    if record is None:
+        mismatches.append("missing from batch.xml")
+
+    # Dates
+    dir_date = issue.date
+    label_date = label_date_re.search(fields["label"] or "")
+    label_date = label_date.group(0) if label_date else None
+    dates = [("dateIssued", fields["date_issued"]),
+             ("LABEL", label_date),
+             ("batch.xml issueDate", record_date)]
+
+    new_date = None
+    if dir_date is None:
+        mismatches.append("directory {0} is not named for a date".format(issue.name))
+    else:
+        for source, date in dates:
+            if date and date != dir_date:
+                mismatches.append("{0} {1} != directory date {2}".format(source, date, dir_date))
+        new_date = agreed(date for _, date in dates)
+        if new_date == dir_date or not label_date_re.match(new_date or ""):
+            new_date = None
+
+    # LCCNs
+    lccns = [("mods:identifier", fields["identifier"]),
+             ("batch.xml lccn", record_lccn)]
+    for source, lccn in lccns:
+        if lccn and lccn != issue.lccn:
+            mismatches.append("{0} {1} != directory LCCN {2}".format(source, lccn, issue.lccn))
+    new_lccn = agreed(lccn for _, lccn in lccns)
+    if new_lccn == issue.lccn or not lccn_dir_re.match(new_lccn or ""):
+        new_lccn = None
+
+    return mismatches, new_date, new_lccn
+
+
+def plan_lccn_ranges(issues, new_lccns):
+    # Group issues needing a new LCCN into runs of consecutive dates for
+    # fix_lccn_by_date.py, which moves every issue of the bad LCCN in its
+    # date range.  Dates where only some editions move can't be expressed
+    # as a range and are left out.  Returns ([(bad, correct, start, end)],
+    # {tail: new lccn} for issues covered by a range, [tails left out]).
+    by_lccn = {}
+    for issue in issues:
+        if issue.date is not None:
+            by_lccn.setdefault(issue.lccn, {}).setdefault(issue.date, []).append(issue.tail)
+
+    ranges = []
+    moved = {}
+    left_out = []
+
+    for bad_lccn in sorted(by_lccn):
+        run = None
+        dates = by_lccn[bad_lccn]
+
+        for date in sorted(dates):
+            targets = set(new_lccns.get(tail) for tail in dates[date])
+            target = targets.pop() if len(targets) == 1 else None
+
+            if run and run[1] == target and target is not None:
+                run[3] = date
+                run[4].extend(dates[date])
+                continue
+
+            if run:
+                ranges.append(run)
+                run = None
+            if target is not None:
+                run = [bad_lccn, target, date, date, list(dates[date])]
+            elif len(targets) > 0:
+                left_out.extend(tail for tail in dates[date] if tail in new_lccns)
+
+        if run:
+            ranges.append(run)
+
+    for bad_lccn, correct_lccn, start_date, end_date, tails in ranges:
+        for tail in tails:
+            moved[tail] = correct_lccn
+
+    return ([lccn_range[:4] for lccn_range in ranges], moved, left_out)
+
+
+def plan_date_corrections(issues, new_dates, moved):
+    # Rows of lccn,bad_date,new_date for fix_dates_by_lccn.py, which fixes
+    # every issue of the LCCN dated bad_date.  The LCCN is the one the issue
+    # has after LCCN ranges are applied, so apply those first.  Returns
+    # (rows, [tails left out where editions disagree]).
+    groups = {}
+    for issue in issues:
+        if issue.date is not None:
+            lccn = moved.get(issue.tail, issue.lccn)
+            groups.setdefault((lccn, issue.date), []).append(issue.tail)
+
+    rows = []
+    left_out = []
+    for (lccn, bad_date), tails in sorted(groups.items()):
+        targets = set(new_dates.get(tail) for tail in tails)
+        if targets == set([None]):
+            continue
+        if len(targets) == 1:
+            rows.append((lccn, bad_date, targets.pop()))
+        else:
+            left_out.extend(tail for tail in tails if tail in new_dates)
+
+    return rows, left_out
+
+
+def write_csv(path, header, rows):
+    with open(path, "wb") as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+# Main
+# ----
+if  __name__ =='__main__':
+    start_time = time.time()
+    print "Auditing {0}".format(search_dir)
+    batch_index = BatchIndex(search_dir, args.index_file)
+    batch_index.refresh()
+    if args.verbose:
+        print "  Listed {0} dirs, reused {1} from index".format(batch_index.dirs_listed, batch_index.dirs_reused)
+
+    # Issues to audit come from the index, without walking the tree
+    batch_paths = batch_index.batch_paths()
+    issues = []
+    for batch_path in batch_paths:
+        for title in Batch.from_index(batch_index, batch_path).titles:
+            if not args.lccns or title.lccn in args.lccns:
+                issues.extend(title.issues())
+
+    # Read batch XML and issue METS in worker processes
+    pool = None
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+
+    try:
+        batch_records = {}
+        if pool:
+            batch_results = pool.imap(read_batch_records, batch_paths)
+        else:
+            batch_results = map(read_batch_records, batch_paths)
+
+        for batch_path, records, error in batch_results:
+            if error:
+                print "  Could not read batch XML in {0}: {1}".format(batch_path[len(search_dir):], error)
+            batch_records[batch_path] = records
+
+        issue_jobs = [(issue.tail, issue.path) for issue in issues]
+        if pool:
+            # Issues are small, so hand them to workers in chunks
+            chunk = max(1, min(256, len(issue_jobs) // (args.jobs * 8)))
+            issue_fields = pool.imap_unordered(read_issue, issue_jobs, chunk)
+        else:
+            issue_fields = map(read_issue, issue_jobs)
+
+        fields_by_tail = {}
+        for tail, fields, error in issue_fields:
+            fields_by_tail[tail] = (fields, error)
+    except KeyboardInterrupt:
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # Compare in the parent, in batch order
+    mismatched = 0
+    new_dates = {}
+    new_lccns = {}
+    for issue in issues:
+        fields, error = fields_by_tail[issue.tail]
+        location = "{0}/{1}".format(issue.batch_path[len(search_dir):], issue.tail)
+
+        if error:
+            mismatched += 1
+            if not args.quiet:
+                print "  {0}: could not read METS: {1}".format(location, error)
+            continue
+
+        record = batch_records.get(issue.batch_path, {}).get(issue.tail)
+        mismatches, new_date, new_lccn = audit_issue(issue, fields, record)
+
+        if mismatches:
+            mismatched += 1
+            if not args.quiet:
+                print "  {0}".format(location)
+                for mismatch in mismatches:
+                    print "    {0}".format(mismatch)
+        elif args.verbose:
+            print "  {0} ok".format(location)
+
+        if new_date:
+            new_dates[issue.tail] = new_date
+        if new_lccn:
+            new_lccns[issue.tail] = new_lccn
+
+    # Batch XML records without an issue directory
+    audited = set((issue.batch_path, issue.tail) for issue in issues)
+    for batch_path in batch_paths:
+        for tail, (lccn, issue_date) in sorted(batch_records[batch_path].items()):
+            if (batch_path, tail) in audited:
+                continue
+            if args.lccns and tail.split('/')[0] not in args.lccns:
+                continue
+            mismatched += 1
+            if not args.quiet:
+                print "  {0}/{1}\n    listed in batch.xml but not found".format(batch_path[len(search_dir):], tail)
+
+    lccn_ranges, moved, lccns_left_out = plan_lccn_ranges(issues, new_lccns)
+    date_rows, dates_left_out = plan_date_corrections(issues, new_dates, moved)
+
+    if not args.quiet:
+        for tail in lccns_left_out:
+            print "  {0}: LCCN differs from other editions of the date, fix by hand".format(tail)
+        for tail in dates_left_out:
+            print "  {0}: date differs from other editions of the date, fix by hand".format(tail)
+
+    if args.manifest:
+        write_csv(args.manifest, ("lccn", "bad_date", "new_date"), date_rows)
+    if args.lccn_manifest:
+        write_csv(args.lccn_manifest,
+                  ("bad_lccn", "correct_lccn", "start_date", "end_date"), lccn_ranges)
+
+    print "Audited {0} issues in {1} batches in {2:.1f}s: {3} mismatched, " \
+          "{4} date corrections, {5} LCCN ranges".format(
+              len(issues), len(batch_paths), time.time() - start_time,
+              mismatched, len(date_rows), len(lccn_ranges))
@@ -0,0 +1,255 @@
+# Persistent index of an NDNP batch tree
+#
+# Batches follow the layout batch/sn########/reel/issue.  The index keeps the
+# directory listings down to the reel level in SQLite, keyed by
+# batch/LCCN/reel/issue, along with each directory's mtime.  Refreshing only
+# re-lists directories whose mtime changed, so repeated fixes become index
+# lookups instead of full filesystem crawls.
+
+from bisect import bisect_left, bisect_right
+import os
+import sqlite3
+import time
+
+from batchlib import issue_dir_re, lccn_dir_re
+
+# Prefer scandir for directory listing, falling back to listdir
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# Index file name created inside the batches directory by default
+INDEX_FILE = '.batch_index.sqlite'
+
+# Directories modified this recently may change again within the same
+# mtime tick, so their listings are always re-read on the next refresh
+RACY_SECONDS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subdirs (
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (parent, name)
+);
+CREATE TABLE IF NOT EXISTS reels (
+    batch TEXT NOT NULL,
+    lccn TEXT NOT NULL,
+    reel TEXT NOT NULL,
+    PRIMARY KEY (batch, lccn, reel)
+);
+CREATE TABLE IF NOT EXISTS issues (
+    batch TEXT NOT NULL,
+    lccn TEXT NOT NULL,
+    reel TEXT NOT NULL,
+    issue TEXT NOT NULL,
+    PRIMARY KEY (batch, lccn, reel, issue)
+);
+CREATE INDEX IF NOT EXISTS reels_lccn ON reels (lccn);
+"""
+
+
+def list_dirs(path):
+    if scandir is not None:
+        return [e.name for e in scandir(path) if e.is_dir()]
+
+    return [d for d in os.listdir(path)
+            if os.path.isdir(os.path.join(path, d))]
+
+
+def open_index_db(index_path):
+    # Fall back to a throwaway in-memory index if the file isn't writable
+    try:
+        db = sqlite3.connect(index_path)
+        db.executescript(SCHEMA)
+    except sqlite3.Error:
+        db = sqlite3.connect(':memory:')
+        db.executescript(SCHEMA)
+
+    db.text_factory = str
+    return db
+
+
+class BatchIndex(object):
+
+    def __init__(self, batches_path, index_path=None):
+        self.batches_path = batches_path
+        if index_path is None:
+            index_path = os.path.join(batches_path, INDEX_FILE)
+        self.index_path = index_path
+        self.db = open_index_db(index_path)
+
+        # Refresh statistics
+        self.dirs_listed = 0
+        self.dirs_reused = 0
+
+        # Sorted issue date keys per LCCN path, built on first range query
+        self._issue_keys = {}
+
+    def close(self):
+        self.db.close()
+
+    def path(self, *parts):
+        return os.path.join(self.batches_path, *[p for p in parts if p])
+
+    def split_lccn_path(self, lccn_path):
+        # Return (batch, lccn) keys for an absolute LCCN directory path
+        rel = os.path.relpath(lccn_path, self.batches_path)
+        batch, lccn = os.path.split(rel)
+        return batch, lccn
+
+    # Refresh
+    # -------
+    def refresh(self):
+        db = self.db
+        mtimes = dict(db.execute("SELECT path, mtime FROM dirs"))
+        children = {}
+        for parent, name in db.execute("SELECT parent, name FROM subdirs"):
+            children.setdefault(parent, []).append(name)
+
+        seen_dirs = set()
+        seen_reels = set()
+        now = time.time()
+        self._issue_keys = {}
+        self.dirs_listed = 0
+        self.dirs_reused = 0
+
+        def subdirs(rel):
+            # Return (names, changed) for the directory at rel
+            seen_dirs.add(rel)
+            mtime = os.stat(self.path(rel)).st_mtime
+
+            if rel in mtimes and mtimes[rel] == mtime:
+                self.dirs_reused += 1
+                return children.get(rel, []), False
+
+            names = list_dirs(self.path(rel))
+            self.dirs_listed += 1
+
+            if now - mtime < RACY_SECONDS:
+                mtime = -1
+            db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)",
+                       (rel, mtime))
+            db.execute("DELETE FROM subdirs WHERE parent = ?", (rel,))
+            db.executemany("INSERT INTO subdirs VALUES (?, ?)",
+                           [(rel, name) for name in names])
+            return names, True
+
+        with db:
+            dirs_to_search = ['']
+
+            while dirs_to_search:
+                batch = dirs_to_search.pop()
+                names, _ = subdirs(batch)
+
+                for d in names:
+                    if not lccn_dir_re.match(d):
+                        dirs_to_search.append(os.path.join(batch, d))
+                        continue
+
+                    lccn_rel = os.path.join(batch, d)
+                    reels, reels_changed = subdirs(lccn_rel)
+                    if reels_changed:
+                        db.execute("DELETE FROM reels WHERE batch = ? AND lccn = ?",
+                                   (batch, d))
+                        db.executemany("INSERT INTO reels VALUES (?, ?, ?)",
+                                       [(batch, d, reel) for reel in reels])
+
+                    for reel in reels:
+                        seen_reels.add((batch, d, reel))
+                        issues, issues_changed = subdirs(os.path.join(lccn_rel, reel))
+                        if issues_changed:
+                            db.execute("DELETE FROM issues WHERE batch = ? AND lccn = ? AND reel = ?",
+                                       (batch, d, reel))
+                            db.executemany("INSERT INTO issues VALUES (?, ?, ?, ?)",
+                                           [(batch, d, reel, issue) for issue in issues])
+
+            # Drop anything that disappeared from the tree
+            for rel in set(mtimes) - seen_dirs:
+                db.execute("DELETE FROM dirs WHERE path = ?", (rel,))
+                db.execute("DELETE FROM subdirs WHERE parent = ?", (rel,))
+
+            indexed_reels = db.execute("SELECT batch, lccn, reel FROM reels").fetchall()
+            for key in set(indexed_reels) - seen_reels:
+                db.execute("DELETE FROM reels WHERE batch = ? AND lccn = ? AND reel = ?", key)
+                db.execute("DELETE FROM issues WHERE batch = ? AND lccn = ? AND reel = ?", key)
+
+    # Lookups
+    # -------
+    def batch_paths(self):
+        # Batch directories, those holding LCCN directories and batch.xml
+        rows = self.db.execute("SELECT DISTINCT batch FROM reels ORDER BY batch")
+        return [self.path(batch) for batch, in rows]
+
+    def lccns(self, batch_path):
+        # LCCNs of the titles directly inside a batch directory
+        batch = os.path.relpath(batch_path, self.batches_path)
+        if batch == os.curdir:
+            batch = ''
+        rows = self.db.execute("SELECT DISTINCT lccn FROM reels WHERE batch = ? "
+                               "ORDER BY lccn", (batch,))
+        return [lccn for lccn, in rows]
+
+    def lccn_paths(self, lccn):
+        rows = self.db.execute("SELECT DISTINCT batch FROM reels WHERE lccn = ? "
+                               "ORDER BY batch", (lccn,))
+        return [self.path(batch, lccn) for batch, in rows]
+
+    def reels(self, lccn_path):
+        # Return {reel: [issue paths]} for an LCCN directory
+        batch, lccn = self.split_lccn_path(lccn_path)
+        reels = {}
+
+        for reel, in self.db.execute("SELECT reel FROM reels WHERE batch = ? AND lccn = ?",
+                                     (batch, lccn)):
+            reels[reel] = []
+
+        for reel, issue in self.db.execute("SELECT reel, issue FROM issues "
+                                           "WHERE batch = ? AND lccn = ? "
+                                           "ORDER BY reel, issue", (batch, lccn)):
+            reels[reel].append(self.path(batch, lccn, reel, issue))
+
+        return reels
+
+    def issue_paths(self, lccn_path):
+        batch, lccn = self.split_lccn_path(lccn_path)
+        rows = self.db.execute("SELECT reel, issue FROM issues "
+                               "WHERE batch = ? AND lccn = ? "
+                               "ORDER BY reel, issue", (batch, lccn))
+        return [self.path(batch, lccn, reel, issue) for reel, issue in rows]
+
+    def issue_keys(self, lccn_path):
+        # Return (keys, paths) for an LCCN directory's issues, sorted by the
+        # integer YYYYMMDDEE key of each issue directory name
+        try:
+            return self._issue_keys[lccn_path]
+        except KeyError:
+            pass
+
+        issues = []
+        for position, issue_path in enumerate(self.issue_paths(lccn_path)):
+            name = os.path.basename(issue_path)
+            if issue_dir_re.match(name):
+                issues.append((int(name), position, issue_path))
+        issues.sort()
+
+        keys = [key for key, _, _ in issues]
+        paths = [(position, issue_path) for _, position, issue_path in issues]
+        self._issue_keys[lccn_path] = keys, paths
+        return keys, paths
+
+    def issues_between(self, lccn_path, start_date_fd, end_date_fd):
+        # Return issue paths dated start_date_fd to end_date_fd (YYYYMMDD),
+        # inclusive and in any edition, ordered by reel and issue
+        keys, paths = self.issue_keys(lccn_path)
+        lo = bisect_left(keys, int(start_date_fd) * 100)
+        hi = bisect_right(keys, int(end_date_fd) * 100 + 99)
+        return [issue_path for _, issue_path in sorted(paths[lo:hi])]
@@ -0,0 +1,92 @@
+# Concurrent repair of independent batches
+#
+# Work grouped by batch root, the directory holding batch.xml, touches no
+# files outside that batch, so separate batches can be repaired at the same
+# time in a process pool.  Each batch is repaired while holding an advisory
+# lock on a file in its batch root, so two runs never edit one batch.xml at
+# once.  Output from pooled batches is collected and printed batch by batch.
+
+from contextlib import contextmanager
+from cStringIO import StringIO
+import fcntl
+import multiprocessing
+import os
+import signal
+import sys
+import traceback
+
+# Lock file created inside each batch root
+LOCK_FILE = '.batch.lock'
+
+
+@contextmanager
+def batch_lock(batch_path, lock=True):
+    # The lock file stays behind: removing it would let a waiting run lock
+    # an unlinked file while a new run locks a fresh one
+    if not lock:
+        yield
+        return
+
+    with open(os.path.join(batch_path, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def ignore_interrupts():
+    # Leave Ctrl-C to the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def repair_batch(job):
+    # Run one batch's repair in a pool worker, returning its output and any
+    # traceback instead of letting one failed batch stop the others
+    repair, batch_path, work, lock = job
+    output = StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    error = None
+
+    try:
+        with batch_lock(batch_path, lock):
+            repair(batch_path, work)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+
+    return batch_path, output.getvalue(), error
+
+
+def run_batches(repair, batch_work, jobs=1, lock=True):
+    # Call repair(batch_path, work) for each batch in batch_work, in up to
+    # jobs processes, locking each batch unless lock is false.  Returns the
+    # batch paths that failed in pool workers; without a pool errors raise.
+    batch_paths = sorted(batch_work)
+
+    if jobs > 1 and len(batch_paths) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(batch_paths)), ignore_interrupts)
+        failed = []
+        try:
+            batch_jobs = [(repair, batch_path, batch_work[batch_path], lock)
+                          for batch_path in batch_paths]
+            for batch_path, output, error in pool.imap(repair_batch, batch_jobs):
+                sys.stdout.write(output)
+                if error:
+                    sys.stderr.write("Failed to repair {0}\n{1}".format(batch_path, error))
+                    failed.append(batch_path)
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        return failed
+
+    for batch_path in batch_paths:
+        with batch_lock(batch_path, lock):
+            repair(batch_path, batch_work[batch_path])
+    return []
@@ -0,0 +1,153 @@
+# Shared handling of a batch's batch.xml and batch_1.xml
+#
+# The two files normally hold the same issue and reel list.  When their
+# contents match they are parsed and edited as one tree and that tree is
+# serialized once for both targets; otherwise each file is handled alone.
+
+from bisect import bisect_right
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+from batchlib import BATCH_FILES, BATCH_NAMESPACES, BATCH_REEL, \
+    serialization_context
+
+# Size of each read when hashing batch files
+CHUNK_SIZE = 64 * 1024
+
+# Numeric part of an LCCN, which orders reels sharing a reel number
+lccn_number_re = re.compile("[0-9]+$")
+
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while 1:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def batch_file_groups(batch_path):
+    # Return lists of batch XML files that can share one parsed tree
+    batch_files = [os.path.join(batch_path, name) for name in BATCH_FILES]
+
+    if (os.path.getsize(batch_files[0]) == os.path.getsize(batch_files[1]) and
+            file_digest(batch_files[0]) == file_digest(batch_files[1])):
+        return [batch_files]
+
+    return [[batch_file] for batch_file in batch_files]
+
+
+def write_batch_files(tree, batch_files):
+    # Serialize the tree once and write the same bytes to each file
+    out = StringIO()
+    tree.write(out, encoding="UTF-8", xml_declaration=True,
+               sort_attributes=False,
+               context=serialization_context(BATCH_NAMESPACES))
+    data = out.getvalue()
+
+    # Replace each file by rename so an interrupted run leaves it whole
+    for batch_file in batch_files:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(batch_file),
+                                         suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            shutil.copymode(batch_file, temp_path)
+            os.rename(temp_path, batch_file)
+        except:
+            os.remove(temp_path)
+            raise
+
+
+def reel_key(reel_path_tail):
+    # Sort key (reel number, LCCN number) for "lccn/reel[/...]" reel text
+    lccn, reel = reel_path_tail.strip().split('/')[:2]
+    return int(reel), int(lccn_number_re.search(lccn).group(0))
+
+
+class ReelIndex(object):
+    # Reel elements of a batch XML root, keyed by (reel number, LCCN) and
+    # kept in document order.  Built once per tree so reels are found by
+    # key instead of scanning and re-parsing every reel's text.  NDNP
+    # batches usually list reels sorted by that key, and new reels are then
+    # placed by bisection; batches that list them some other way, such as
+    # grouped by title, get new reels after the last reel of their LCCN.
+
+    def __init__(self, root):
+        self.root = root
+        self.keys = []
+        self.elements = []
+        self.by_key = {}
+        self._base = None
+
+        for position, child in enumerate(root):
+            if child.tag == BATCH_REEL:
+                if self._base is None:
+                    self._base = position
+                key = reel_key(child.text)
+                self.keys.append(key)
+                self.elements.append(child)
+                self.by_key.setdefault(key, child)
+
+        self.sorted = all(self.keys[i] <= self.keys[i + 1]
+                          for i in range(len(self.keys) - 1))
+
+    def __len__(self):
+        return len(self.elements)
+
+    def root_position(self, i):
+        # Reels normally follow the issues contiguously, so the element at
+        # index i sits at base + i; check that before searching the root
+        position = self._base + i
+        if position < len(self.root) and self.root[position] is self.elements[i]:
+            return position
+        return list(self.root).index(self.elements[i])
+
+    def find(self, reel_path_tail):
+        # Reel element for "lccn/reel[/...]", or None if the batch lacks it
+        return self.by_key.get(reel_key(reel_path_tail))
+
+    def insertion_index(self, key):
+        if self.sorted:
+            return bisect_right(self.keys, key)
+
+        # After the last reel of the same LCCN, or after every reel
+        for i in range(len(self.keys) - 1, -1, -1):
+            if self.keys[i][1] == key[1]:
+                return i + 1
+        return len(self.keys)
+
+    def insert(self, element):
+        key = reel_key(element.text)
+        i = self.insertion_index(key)
+
+        if i < len(self.elements):
+            self.root.insert(self.root_position(i), element)
+        elif self.elements:
+            self.root.insert(self.root_position(i - 1) + 1, element)
+        else:
+            self._base = len(self.root)
+            self.root.append(element)
+
+        self.keys.insert(i, key)
+        self.elements.insert(i, element)
+        self.by_key.setdefault(key, element)
+
+    def remove(self, element):
+        i = self.elements.index(element)
+        del self.root[self.root_position(i)]
+        key = self.keys.pop(i)
+        del self.elements[i]
+
+        # Another reel may carry the same key
+        if self.by_key.get(key) is element:
+            del self.by_key[key]
+            if key in self.keys:
+                self.by_key[key] = self.elements[self.keys.index(key)]
@@ -0,0 +1,290 @@
+# Shared model and XML handling for NDNP batch repair scripts
+#
+# Batches follow the layout batch/sn########/reel/issue, with issue METS
+# and ALTO page files inside each issue directory and batch.xml and
+# batch_1.xml listing the batch's issues and reels.  This module holds the
+# namespace tables, tags, name patterns and comment-retaining parser the
+# repair scripts share, each set up once at import, along with a small
+# Batch/Title/Reel/Issue/Page model built from paths or the batch index.
+
+import os
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+
+# Namespaces
+# ----------
+METS_NS = "http://www.loc.gov/METS/"
+MIX_NS = "http://www.loc.gov/mix/"
+MODS_NS = "http://www.loc.gov/mods/v3"
+NDNP_NS = "http://www.loc.gov/ndnp"
+NP_NS = "urn:library-of-congress:ndnp:mets:newspaper"
+PREMIS_NS = "http://www.oclc.org/premis"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+
+# Prefixes written for issue METS and batch XML.  Both use the default
+# prefix for a different namespace, so the table in use is registered
+# again whenever the other kind of file is parsed.
+METS_NAMESPACES = (
+    ("", METS_NS),
+    ("mix", MIX_NS),
+    ("ndnp", NDNP_NS),
+    ("premis", PREMIS_NS),
+    ("mods", MODS_NS),
+    ("xsi", XSI_NS),
+    ("xlink", XLINK_NS),
+    ("np", NP_NS),
+)
+BATCH_NAMESPACES = (
+    ("", NDNP_NS),
+    ("xsi", XSI_NS),
+)
+
+# METS elements that declare namespaces ET would otherwise drop: only the
+# structMap's TYPE attribute values refer to the np prefix
+METS_PINNED_NAMESPACES = {
+    "{%s}structMap" % METS_NS: [NP_NS],
+}
+
+# Tags
+MODS_IDENTIFIER = "{%s}identifier" % MODS_NS
+MODS_DATE_ISSUED = "{%s}dateIssued" % MODS_NS
+BATCH_ISSUE = "{%s}issue" % NDNP_NS
+BATCH_REEL = "{%s}reel" % NDNP_NS
+
+
+# Names
+# -----
+BATCH_FILES = ("batch.xml", "batch_1.xml")
+
+lccn_dir_re = re.compile("^[a-z]{1,3}[0-9]{8,10}$")
+reel_dir_re = re.compile("^[0-9]{11}$")
+issue_dir_re = re.compile("^[0-9]{10}$")
+alto_file_re = re.compile("[0-9]{4}\.xml")
+
+
+def date_fd(date):
+    # Date in file descriptor naming format, YYYY-MM-DD -> YYYYMMDD
+    return date.replace('-', '')
+
+
+def is_alto_file(name):
+    return alto_file_re.match(name) is not None
+
+
+def is_mets_file(name):
+    return name.find('.xml') >= 0 and not is_alto_file(name)
+
+
+# XML
+# ---
+def CommentRetainer(ordered_attributes=False):
+    # XML parser to retain comments, on the C parser when ElementTree has
+    # it, or on the Python parser when keeping attributes in document order
+    return ET.XMLParser(
+        target=ET.CommentTreeBuilder(ordered_attributes=ordered_attributes),
+        ordered_attributes=ordered_attributes)
+
+
+_registered_namespaces = [None]
+
+
+def use_namespaces(namespaces):
+    # Register a namespace table unless it is already the one in use; all
+    # registration has to go through here for that check to hold
+    if _registered_namespaces[0] is namespaces:
+        return
+
+    for prefix, uri in namespaces:
+        ET.register_namespace(prefix, uri)
+    _registered_namespaces[0] = namespaces
+
+
+_contexts = {}
+
+
+def serialization_context(namespaces):
+    # Serialization context for files written with a namespace table,
+    # built from the table's registered prefixes on first use.  The names
+    # it works out are reused for every file written after.
+    context = _contexts.get(namespaces)
+    if context is None:
+        use_namespaces(namespaces)
+        context = _contexts[namespaces] = ET.SerializationContext()
+    return context
+
+
+# METS files are many, so they are parsed on the C parser and written with
+# sorted attributes unless asked to keep document order.  Batch XML is
+# parsed and written in document order, so rewritten batch files differ
+# from the originals only where they were changed.
+def parse_mets(file_path, ordered_attributes=False):
+    use_namespaces(METS_NAMESPACES)
+    return ET.parse(file_path,
+                    parser=CommentRetainer(ordered_attributes=ordered_attributes))
+
+
+def parse_batch_xml(file_path):
+    use_namespaces(BATCH_NAMESPACES)
+    return ET.parse(file_path, parser=CommentRetainer(ordered_attributes=True))
+
+
+def write_mets(tree, file_path, sort_attributes=True):
+    # Write beside the file and rename so an interruption never leaves it
+    # half written
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path),
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            tree.write(out, encoding="UTF-8",
+                       xml_declaration=True,
+                       pinned_namespaces=METS_PINNED_NAMESPACES,
+                       sort_attributes=sort_attributes,
+                       context=serialization_context(METS_NAMESPACES))
+        shutil.copymode(file_path, temp_path)
+        os.rename(temp_path, file_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def issue_path_tail(issue_file):
+    # lccn/reel/issue key of a batch XML issue file path
+    return '/'.join(issue_file.strip().split('/')[-4:-1])
+
+
+def batch_issue_tail(issue):
+    # lccn/reel/issue key of a batch XML issue element
+    return issue_path_tail(issue.text)
+
+
+# Model
+# -----
+class Page(object):
+    __slots__ = ("issue", "sequence", "path")
+
+    def __init__(self, issue, sequence, path):
+        self.issue = issue
+        self.sequence = sequence
+        self.path = path
+
+    def __repr__(self):
+        return "<Page {0}/{1:04d}>".format(self.issue.tail, self.sequence)
+
+
+class Issue(object):
+    __slots__ = ("batch_path", "lccn", "reel", "name", "path")
+
+    def __init__(self, batch_path, lccn, reel, name):
+        self.batch_path = batch_path
+        self.lccn = lccn
+        self.reel = reel
+        self.name = name
+        self.path = os.path.join(batch_path, lccn, reel, name)
+
+    @classmethod
+    def from_path(cls, issue_path):
+        reel_path, name = os.path.split(issue_path)
+        lccn_path, reel = os.path.split(reel_path)
+        batch_path, lccn = os.path.split(lccn_path)
+        return cls(batch_path, lccn, reel, name)
+
+    def __repr__(self):
+        return "<Issue {0}>".format(self.tail)
+
+    @property
+    def tail(self):
+        # Path below the batch root, as batch XML refers to the issue
+        return "{0}/{1}/{2}".format(self.lccn, self.reel, self.name)
+
+    @property
+    def date(self):
+        # YYYY-MM-DD, or None if the directory isn't named for a date
+        if not issue_dir_re.match(self.name):
+            return None
+        return "{0}-{1}-{2}".format(self.name[:4], self.name[4:6], self.name[6:8])
+
+    @property
+    def edition(self):
+        return int(self.name[8:]) if issue_dir_re.match(self.name) else None
+
+    def files(self):
+        return sorted(os.listdir(self.path))
+
+    def mets_paths(self):
+        return [os.path.join(self.path, f) for f in self.files() if is_mets_file(f)]
+
+    def pages(self):
+        return [Page(self, int(f[:4]), os.path.join(self.path, f))
+                for f in self.files() if is_alto_file(f)]
+
+
+class Reel(object):
+    __slots__ = ("batch_path", "lccn", "number", "path", "issues")
+
+    def __init__(self, batch_path, lccn, number, issues=None):
+        self.batch_path = batch_path
+        self.lccn = lccn
+        self.number = number
+        self.path = os.path.join(batch_path, lccn, number)
+        self.issues = issues or []
+
+    def __repr__(self):
+        return "<Reel {0}>".format(self.tail)
+
+    @property
+    def tail(self):
+        return "{0}/{1}".format(self.lccn, self.number)
+
+
+class Title(object):
+    __slots__ = ("batch_path", "lccn", "path", "reels")
+
+    def __init__(self, batch_path, lccn, reels=None):
+        self.batch_path = batch_path
+        self.lccn = lccn
+        self.path = os.path.join(batch_path, lccn)
+        self.reels = reels or []
+
+    def __repr__(self):
+        return "<Title {0}>".format(self.lccn)
+
+    def issues(self):
+        return [issue for reel in self.reels for issue in reel.issues]
+
+
+class Batch(object):
+    __slots__ = ("path", "titles")
+
+    def __init__(self, path, titles=None):
+        self.path = path
+        self.titles = titles or []
+
+    def __repr__(self):
+        return "<Batch {0}>".format(self.path)
+
+    @classmethod
+    def from_index(cls, batch_index, batch_path):
+        # Build the batch's titles, reels and issues from the batch index
+        # without touching the filesystem
+        batch = cls(batch_path)
+        for lccn in batch_index.lccns(batch_path):
+            title = Title(batch_path, lccn)
+            reels = batch_index.reels(title.path)
+            for number in sorted(reels):
+                reel = Reel(batch_path, lccn, number)
+                reel.issues = [Issue(batch_path, lccn, number, os.path.basename(p))
+                               for p in reels[number]]
+                title.reels.append(reel)
+            batch.titles.append(title)
+        return batch
+
+    @property
+    def batch_files(self):
+        return [os.path.join(self.path, name) for name in BATCH_FILES]
+
+    def issues(self):
+        return [issue for title in self.titles for issue in title.issues()]
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+import argparse
+from datetime import datetime, timedelta
+import imp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from batch_index import BatchIndex
+from journal import Journal
+from rewrite_rules import RewriteEngine, date_rules, lccn_rules
+
+
+
+# Defaults
+# --------
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# make_test_batches.py writes titles from this LCCN and date on
+first_lccn = 'sn84020109'
+second_lccn = 'sn84020110'
+start_date = '1900-01-01'
+
+# Steps timed, in the order they run on each copy of the batches
+steps = ["index refresh", "find_lccn_paths", "fix_dates", "update_batch_dates",
+         "fix_lccns", "update_batch_lccns"]
+
+
+
+# Arguments
+# ---------
+parser = argparse.ArgumentParser(description="Time the repair scripts on "
+                                             "synthetic batches")
+
+# Optional args
+parser.add_argument("-b", "--batches", type=int, default=2,
+                    help="batches to generate (default: 2)")
+parser.add_argument("-c", "--compare",
+                    help="results JSON of an earlier run to compare against")
+parser.add_argument("-d", "--work_dir",
+                    help="directory for generated batches (default: a temporary directory)")
+parser.add_argument("-i", "--issues", type=int, default=30,
+                    help="daily issues on each reel (default: 30)")
+parser.add_argument("-k", "--keep", action="store_true",
+                    help="keep generated and repaired batches")
+parser.add_argument("-m", "--move_issues", type=int, default=10,
+                    help="issues moved to a new LCCN by fix_lccns (default: 10)")
+parser.add_argument("-n", "--repeat", type=int, default=3,
+                    help="runs of each step on a fresh copy of the batches (default: 3)")
+parser.add_argument("-o", "--output",
+                    help="write results as JSON, for a later --compare")
+parser.add_argument("-p", "--pages", type=int, default=4,
+                    help="pages in each issue (default: 4)")
+parser.add_argument("-r", "--reels", type=int, default=1,
+                    help="reels of each title in each batch (default: 1)")
+parser.add_argument("-t", "--titles", type=int, default=2,
+                    help="titles (LCCNs) in each batch (default: 2)")
+parser.add_argument("-w", "--words", type=int, default=1000,
+                    help="words on each ALTO page (default: 1000)")
+parser.add_argument("--threshold", type=float, default=10.0,
+                    help="percent slower than --compare results counted as a "
+                         "regression (default: 10)")
+
+args = parser.parse_args()
+
+if args.titles < 1 or args.issues < 2:
+    parser.error("need at least one title of two issues")
+
+
+
+# Functions
+# ---------
+def load_script(name, script_args):
+    # Import a repair script for its functions, parsing script_args as its
+    # command line; the script's main block doesn't run
+    argv = sys.argv
+    sys.argv = [name + ".py"] + script_args
+    try:
+        return imp.load_source(name, os.path.join(script_dir, name + ".py"))
+    finally:
+        sys.argv = argv
+
+
+def generate(batches_path):
+    subprocess.check_call([sys.executable,
+                           os.path.join(script_dir, "make_test_batches.py"), "-q",
+                           "-b", str(args.batches), "-i", str(args.issues),
+                           "-p", str(args.pages), "-r", str(args.reels),
+                           "-t", str(args.titles), "-w", str(args.words),
+                           "-d", start_date, batches_path])
+
+
+class Timer(object):
+    # Times the steps of one run, keeping their output off the console
+
+    def __init__(self, results):
+        self.results = results
+
+    def __call__(self, step, func, *func_args):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            start = time.time()
+            value = func(*func_args)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        self.results.setdefault(step, []).append(elapsed)
+        return value
+
+
+def run_once(batches_path, timer, bad_date, new_date, end_date):
+    # Load the scripts against this copy of the batches
+    dates = load_script("fix_dates_by_lccn", ["-q", "-s", batches_path,
+                                              first_lccn, bad_date, new_date])
+    lccns = load_script("fix_lccn_by_date", ["-q", "-s", batches_path,
+                                             first_lccn, second_lccn,
+                                             start_date, end_date])
+
+    batch_index = BatchIndex(batches_path)
+    timer("index refresh", batch_index.refresh)
+    timer("find_lccn_paths", lccns.find_lccn_paths, batch_index)
+
+    # Date fix of one issue date in the first title
+    dates.engine = RewriteEngine(date_rules(first_lccn, bad_date, new_date))
+    dates.pool = None
+
+    def fix_dates():
+        batch_edits = {}
+        for lccn_path in dates.find_lccn_paths(batch_index, first_lccn):
+            batch_path = os.path.dirname(lccn_path)
+            for bdp in dates.find_bad_date_paths(batch_index, lccn_path, bad_date):
+                if dates.fix_dates(bdp, bad_date, new_date):
+                    edits = batch_edits.setdefault(batch_path, {})
+                    edits[os.path.relpath(bdp, batch_path)] = (bad_date, new_date)
+        return batch_edits
+
+    def update_batch_dates(batch_edits):
+        for batch_path in sorted(batch_edits):
+            dates.update_batch_dates(batch_path, batch_edits[batch_path])
+
+    batch_edits = timer("fix_dates", fix_dates)
+    timer("update_batch_dates", update_batch_dates, batch_edits)
+
+    # LCCN move of the first issues of the first title
+    batch_index.refresh()
+
+    def fix_lccns():
+        plan = lccns.plan_lccn_moves(batch_index)
+        lccns.engine = RewriteEngine()
+        for op in plan:
+            if op["op"] == "batch":
+                lccns.engine.extend(lccn_rules(first_lccn, second_lccn, op["issues"]))
+        lccns.execute_plan([op for op in plan if op["op"] != "batch"], Journal(None))
+        return [op for op in plan if op["op"] == "batch"]
+
+    def update_batch_lccns(batch_ops):
+        for op in batch_ops:
+            lccns.update_batch_lccns(op)
+
+    batch_ops = timer("fix_lccns", fix_lccns)
+    timer("update_batch_lccns", update_batch_lccns, batch_ops)
+
+    batch_index.close()
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+# Main
+# ----
+if  __name__ =='__main__':
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark_fixes.")
+    template_path = os.path.join(work_dir, "template")
+    scale = {"batches": args.batches, "titles": args.titles, "reels": args.reels,
+             "issues": args.issues, "pages": args.pages, "words": args.words,
+             "move_issues": args.move_issues}
+
+    # The bad date is the first title's second issue and the new date one
+    # before any generated issue, so the fix is never skipped
+    first_day = datetime.strptime(start_date, "%Y-%m-%d")
+    bad_date = (first_day + timedelta(days=1)).date().isoformat()
+    new_date = (first_day - timedelta(days=1)).date().isoformat()
+    end_date = (first_day + timedelta(days=args.move_issues - 1)).date().isoformat()
+
+    print "Generating {batches} batches of {titles} titles, {reels} reels of " \
+          "{issues} issues of {pages} pages of {words} words".format(**scale)
+    start = time.time()
+    generate(template_path)
+    print "  Generated in {0:.1f}s".format(time.time() - start)
+
+    results = {}
+    timer = Timer(results)
+    try:
+        for run in range(args.repeat):
+            batches_path = os.path.join(work_dir, "run{0}".format(run + 1))
+            shutil.copytree(template_path, batches_path)
+            run_once(batches_path, timer, bad_date, new_date, end_date)
+            if not args.keep:
+                shutil.rmtree(batches_path)
+    finally:
+        if not args.keep:
+            shutil.rmtree(template_path, ignore_errors=True)
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as compare_file:
+            baseline = json.load(compare_file)["results"]
+
+    # Best of the runs is the least noisy figure to compare
+    regressions = []
+    print "\n{0:<20} {1:>10} {2:>10}{3}".format("step", "best", "median",
+                                               "   vs baseline" if baseline else "")
+    for step in steps:
+        best = min(results[step])
+        line = "{0:<20} {1:>9.4f}s {2:>9.4f}s".format(step, best, median(results[step]))
+
+        if baseline and step in baseline:
+            baseline_best = min(baseline[step])
+            change = (best - baseline_best) / baseline_best * 100 if baseline_best else 0.0
+            line += "   {0:+7.1f}%".format(change)
+            if change > args.threshold:
+                line += " REGRESSION"
+                regressions.append(step)
+        print line
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"scale": scale, "results": results}, output,
+                      indent=2, sort_keys=True)
+            output.write("\n")
+
+    if regressions:
+        sys.exit("{0} steps more than {1}% slower than {2}".format(
+            len(regressions), args.threshold, args.compare))
@@ -0,0 +1,82 @@
+# Cheap duplication of large files
+#
+# Reel target images run to hundreds of megabytes, and moving issues to a
+# new LCCN duplicates them into a second reel directory.  When source and
+# destination share a filesystem the copy can instead be a reflink, sharing
+# blocks copy-on-write, or a hardlink to the same inode.  Each strategy falls
+# back to the next one in COPY_STRATEGIES when it isn't supported.
+
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Strategies from cheapest to most expensive
+COPY_STRATEGIES = ("reflink", "hardlink", "copy")
+
+# Linux ioctl cloning one file's extents into another (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+# Errors meaning a strategy can't be used here, rather than a failed copy
+UNSUPPORTED_ERRNOS = set([errno.EXDEV, errno.EPERM, errno.EINVAL,
+                          errno.ENOTTY, errno.EMLINK, errno.EOPNOTSUPP,
+                          getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)])
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks not supported", dst)
+
+    try:
+        with open(src, "rb") as source:
+            with open(dst, "wb") as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+    except:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+    shutil.copystat(src, dst)
+
+
+def hardlink(src, dst):
+    os.link(src, dst)
+
+
+copy_functions = {
+    "reflink": reflink,
+    "hardlink": hardlink,
+    "copy": shutil.copy2,
+}
+
+
+def same_filesystem(src, dst_dir):
+    return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+
+
+def copy_file(src, dst_dir, strategy="reflink"):
+    # Copy src into dst_dir using strategy or a more expensive one it falls
+    # back to.  Returns the strategy that made the copy.
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    strategies = COPY_STRATEGIES[COPY_STRATEGIES.index(strategy):]
+
+    if not same_filesystem(src, dst_dir):
+        strategies = ("copy",)
+
+    # Unlink any copy left behind by an interrupted run rather than writing
+    # through it, since a hardlinked copy shares the source's inode
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    for used in strategies:
+        try:
+            copy_functions[used](src, dst)
+            return used
+        except (IOError, OSError) as e:
+            if used == "copy" or e.errno not in UNSUPPORTED_ERRNOS:
+                raise
@@ -1,25 +1,18 @@
 #!/usr/bin/env python
 
 import argparse
-import fileinput
+import csv
+import multiprocessing
 import os
 import re
 import sys
 import time
-import xml.etree.ElementTree as ET
+from datetime import datetime
 
-# XML parser to retain comments
-class CommentRetainer(ET.XMLTreeBuilder):
-
-   def __init__(self):
-       ET.XMLTreeBuilder.__init__(self)
-       # assumes ElementTree 1.2.X
-       self._parser.CommentHandler = self.handle_comment
-
-   def handle_comment(self, data):
-       self._target.start(ET.Comment, {})
-       self._target.data(data)
-       self._target.end(ET.Comment)
+from batch_index import BatchIndex
+from batch_pool import run_batches
+from batchlib import date_fd, is_alto_file
+from rewrite_rules import RewriteEngine, date_rules
 
 
 
@@ -36,6 +29,13 @@ parser = argparse.ArgumentParser()
 # Optional args
 parser.add_argument("-d", "--dry_run", action="store_true",
                     help="don't make any changes to preview outcome")
+parser.add_argument("-i", "--index_file",
+                    help="batch index file (default: <search_dir>/.batch_index.sqlite)")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="processes repairing separate batches, or rewriting "
+                         "XML files of a single batch (default: 1)")
+parser.add_argument("-m", "--manifest",
+                    help="CSV of lccn,bad_date,new_date corrections to apply in one pass")
 parser.add_argument("-q", "--quiet", action="store_true",
                     help="suppress output")
 parser.add_argument("-s", "--search_dir",
@@ -44,22 +44,14 @@ parser.add_argument("-v", "--verbose", action="store_true",
                     help="extra processing information")
 
 # Positional args
-parser.add_argument("lccn", help="LCCN to be fixed")
-parser.add_argument("bad_date", help="incorrect date")
-parser.add_argument("new_date", help="corrected date")
+parser.add_argument("lccn", nargs="?", help="LCCN to be fixed")
+parser.add_argument("bad_date", nargs="?", help="incorrect date")
+parser.add_argument("new_date", nargs="?", help="corrected date")
 
 args = parser.parse_args()
 
-
-# Assign args
-lccn = args.lccn
-bad_date = args.bad_date
-new_date = args.new_date
-
-# Modify dates to file descriptor naming format
-bad_date_fd = bad_date.replace('-', '')
-bad_date_re = re.compile(bad_date_fd)
-new_date_fd = new_date.replace('-', '')
+if not args.manifest and not (args.lccn and args.bad_date and args.new_date):
+    parser.error("provide lccn, bad_date and new_date or a --manifest")
 
 # Handle optional redefined batch directory
 if args.search_dir:
@@ -70,17 +62,50 @@ if args.search_dir:
 
 # Functions
 # ---------
-def find_bad_date_paths(lccn_path):
+def parse_date(date):
+    # YYYY-MM-DD as written in METS and batch XML, raising ValueError if
+    # date isn't a valid date in that form
+    date = datetime.strptime(date, "%Y-%m-%d").date()
+    return "{0:04d}-{1:02d}-{2:02d}".format(date.year, date.month, date.day)
+
+
+def load_manifest(manifest_path):
+    corrections = []
+
+    with open(manifest_path, 'rb') as manifest:
+        reader = csv.reader(manifest)
+        for row in reader:
+            # Skip blank lines, comments and a header row
+            if not row or row[0].startswith('#') or row[0].strip() == 'lccn':
+                continue
+
+            if len(row) < 3:
+                sys.exit("{0}:{1}: expected lccn,bad_date,new_date, found {2} "
+                         "field(s)".format(manifest_path, reader.line_num, len(row)))
+            lccn, bad_date, new_date = [field.strip() for field in row[:3]]
+
+            try:
+                bad_date, new_date = parse_date(bad_date), parse_date(new_date)
+            except ValueError:
+                sys.exit("{0}:{1}: dates must be YYYY-MM-DD".format(
+                    manifest_path, reader.line_num))
+            corrections.append((lccn, bad_date, new_date))
+
+    return corrections
+
+
+def find_bad_date_paths(batch_index, lccn_path, bad_date):
     bad_date_paths = []
+    bad_date_fd = date_fd(bad_date)
 
-    for root, dirs, files in os.walk(lccn_path):
-        for d in dirs:
+    for issue_path in batch_index.issue_paths(lccn_path):
+        d = os.path.basename(issue_path)
+        if args.verbose:
+            print "  Test if dir {0} ~ bad date {1}".format(d, bad_date_fd)
+        if d.startswith(bad_date_fd):
             if args.verbose:
-                print "  Test if dir {0} ~ bad date {1}".format(d, bad_date_fd)
-            if d.find(bad_date_fd) >= 0:
-                if args.verbose:
-                    print "    Dir {0} ~ {1}".format(d, bad_date_fd)
-                bad_date_paths.append(os.path.join(root, d))
+                print "    Dir {0} ~ {1}".format(d, bad_date_fd)
+            bad_date_paths.append(issue_path)
 
     if len(bad_date_paths) == 0:
         print "  Could not find batches with bad date {0}".format(bad_date)
@@ -88,17 +113,12 @@ def find_bad_date_paths(lccn_path):
     return bad_date_paths
 
 
-def find_lccn_paths():
-    lccn_paths = []
+def find_lccn_paths(batch_index, lccn):
+    lccn_paths = batch_index.lccn_paths(lccn)
 
-    for root, dirs, files in os.walk(search_dir):
-        for d in dirs:
-            if args.verbose:
-                print "  Test if dir {0} ~ LCCN {1}".format(d, lccn)
-            if d.find(lccn) >= 0:
-                if args.verbose:
-                    print "    Dir {0} ~ LCCN".format(d)
-                lccn_paths.append(os.path.join(root, d))
+    if args.verbose:
+        for d in lccn_paths:
+            print "    Dir {0} ~ LCCN".format(d[len(search_dir):])
 
     if len(lccn_paths) == 0:
         print "  Could not find batches identified by LCCN {0}".format(lccn)
@@ -106,7 +126,34 @@ def find_lccn_paths():
     return lccn_paths
 
 
-def fix_dates(bad_date_path):
+def rewrite_dates(file_path):
+    # Apply the date rules of every correction to one ALTO or METS file in
+    # a single pass, run in a worker process when --jobs is greater than
+    # one.  Returns "skipped" if the file was skipped without the bad date,
+    # "unchanged" if it had the bad date but no rule changed it, otherwise
+    # "rewritten".
+    changes = engine.rewrite(file_path)
+    if changes is None:
+        return "skipped"
+    return "rewritten" if changes else "unchanged"
+
+
+def fix_dates(bad_date_path, bad_date, new_date, pool=None):
+    bad_date_fd = date_fd(bad_date)
+    bad_date_re = re.compile(bad_date_fd)
+    new_date_fd = date_fd(new_date)
+
+    # Replace bad date in path with new date
+    new_date_path = os.path.join(os.path.dirname(bad_date_path),
+        bad_date_re.sub(new_date_fd, os.path.basename(bad_date_path)))
+
+    if os.path.exists(new_date_path):
+        print "    Skip {0}, {1} already exists".format(bad_date_fd, new_date_fd)
+        return None
+
+    rewrites = []
+    renames = []
+
     for f in os.listdir(bad_date_path):
         if f.find('.xml') >= 0:
             file_path = os.path.join(bad_date_path, f)
@@ -114,137 +161,138 @@ def fix_dates(bad_date_path):
             if not args.quiet and not f[-6:] == "_1.xml":
                 print "    Fix date in file {0}".format(f)
 
-            alto_file = 0
-            alto_file_re = re.compile("[0-9]{4}\.xml")
-            if alto_file_re.match(f): alto_file = 1
-
-            # Don't replace dates if a dry run
-            if not args.dry_run:
-                # Update Alto XML
-                # ---------------
-                if alto_file:
-                    # Set namespaces before parsing
-                    ET.register_namespace("", "http://schema.ccs-gmbh.com/ALTO")
-
-                    tree = ET.parse(file_path, parser=CommentRetainer())
-                    root = tree.getroot()
-
-                    # Replace bad date in string elements
-                    for string in root.findall("PrintSpace//String"):
-                        text = string.get("CONTENT")
-                        if text.find(bad_date) >= 0:
-                            string.set("CONTENT",
-                                       text.replace(bad_date, new_date))
-
-                    tree.write(file_path, encoding="UTF-8",
-                               xml_declaration=True)
-                # Update METS XML
-                # ---------------
-                else:
-                    # Set namespaces before parsing
-                    ET.register_namespace("", "http://www.loc.gov/METS/")
-                    ET.register_namespace("mix", "http://www.loc.gov/mix/")
-                    ET.register_namespace("ndnp", "http://www.loc.gov/ndnp")
-                    ET.register_namespace("premis", "http://www.oclc.org/premis")
-                    ET.register_namespace("mods", "http://www.loc.gov/mods/v3")
-                    ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
-                    ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
-                    ET.register_namespace("np", "urn:library-of-congress:ndnp:mets:newspaper")
-
-                    tree = ET.parse(file_path, parser=CommentRetainer())
-                    root = tree.getroot()
-
-                    # Replace bad date in root's label attribute
-                    label = root.get("LABEL")
-                    if label.find(bad_date) >= 0:
-                        root.set("LABEL", label.replace(bad_date, new_date))
-
-                    # Replace bad date in dateIssued element
-                    date = root.find(".//{http://www.loc.gov/mods/v3}dateIssued")
-                    date.text = date.text.replace(bad_date, new_date)
-
-                    tree.write(file_path, encoding="UTF-8",
-                               xml_declaration=True)
-
-                    # Restore structmap namespace that ET doesn't write
-                    file = fileinput.FileInput(file_path, inplace=1)
-                    for line in file:
-                        print line.replace('<structMap>', '<structMap xmlns:np="urn:library-of-congress:ndnp:mets:newspaper">'),
-
-                    fileinput.close()
+            rewrites.append(file_path)
 
             # Replace bad date in file name with new date
             # -------------------------------------------
-            if (not alto_file and f.find(bad_date_fd) >= 0):
+            if (not is_alto_file(f) and f.find(bad_date_fd) >= 0):
                 new_file_fd = bad_date_re.sub(new_date_fd, f)
                 new_file_path = os.path.join(bad_date_path, new_file_fd)
 
                 if not args.quiet and not f[-6:] == "_1.xml":
                     print "      Replace {0} in file name with {1}".format(bad_date_fd, new_date_fd)
 
-                if not args.dry_run:
-                    os.rename(file_path, new_file_path)
+                renames.append((file_path, new_file_path))
 
-    # Replace bad date in path with new date
-    # --------------------------------------
-    new_date_path = bad_date_re.sub(new_date_fd, bad_date_path)
+    # Don't replace dates if a dry run
+    if not args.dry_run:
+        # All file rewrites finish before anything in the issue is renamed
+        if pool:
+            rewritten = pool.map(rewrite_dates, rewrites)
+        else:
+            rewritten = [rewrite_dates(rewrite) for rewrite in rewrites]
+
+        if not args.quiet:
+            print "    Rewrote {0} files, left {1} unchanged, skipped {2} without {3}".format(rewritten.count("rewritten"), rewritten.count("unchanged"), rewritten.count("skipped"), bad_date)
 
+        for file_path, new_file_path in renames:
+            os.rename(file_path, new_file_path)
+
+    # Replace bad date in dir name with new date
+    # ------------------------------------------
     if not args.quiet:
         print "    Replace {0} in dir name with {1}".format(bad_date_fd, new_date_fd)
 
     if not args.dry_run:
         os.rename(bad_date_path, new_date_path)
 
-    # Update issue record in batch(_1).xml files
-    # ------------------------------------------
+    return new_date_path
+
+
+def update_batch_dates(batch_path, issue_edits):
+    # Update issue records in batch(_1).xml files once for all issues in
+    # the batch, issue_edits mapping lccn/reel/issue -> (bad_date, new_date)
     if not args.quiet:
-        print "    Update dates in batch XML covering {0}".format(lccn)
+        print "\n  Update dates in batch XML covering {0}".format(batch_path[len(search_dir):])
 
-    if not args.dry_run:
-        # Determine batch file and bad date paths
-        batch_path_re = re.compile('^(.+)\/sn[0-9]{8}\/')
-        batch_path = batch_path_re.match(bad_date_path).group(1)
-        batch_files = [os.path.join(batch_path, "batch.xml"), os.path.join(batch_path, "batch_1.xml")]
+    if args.dry_run:
+        return
 
-        bad_date_path_tail_re = re.compile(".+\/({0}\/.+)$".format(lccn))
-        bad_date_path_tail = bad_date_path_tail_re.match(bad_date_path).group(1)
+    # Rules limited to the issues fixed, grouped by correction
+    issue_tails = {}
+    for issue_path_tail, (bad_date, new_date) in issue_edits.items():
+        lccn = issue_path_tail.split('/')[0]
+        issue_tails.setdefault((lccn, bad_date, new_date), []).append(issue_path_tail)
 
-        for batch_file in batch_files:
-            # Set namespaces before parsing
-            ET.register_namespace("", "http://www.loc.gov/ndnp")
-            #ET.register_namespace("ndnp", "http://www.loc.gov/ndnp")
-            ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    batch_engine = RewriteEngine()
+    for (lccn, bad_date, new_date), tails in sorted(issue_tails.items()):
+        batch_engine.extend(date_rules(lccn, bad_date, new_date, tails))
 
-            tree = ET.parse(batch_file, parser=CommentRetainer())
-            root = tree.getroot()
+    # batch.xml and batch_1.xml share one tree when their contents match
+    results = batch_engine.rewrite_batch(batch_path)
+    if args.verbose and len(results) > 1:
+        print "    batch.xml and batch_1.xml differ, updating each separately"
 
-            # Iterate through issue elements to update path of issue just fixed
-            for issue in root.iter():
-                if issue.text.find(bad_date_path_tail) >= 0:
-                    issue_date = issue.get("issueDate")
-                    if not args.quiet and not batch_file[-6:] == "_1.xml":
-                        print "      Update issue {0} replacing {1} with {2}".format(issue_date, bad_date, new_date)
+    for batch_files, changes in results:
+        if not args.quiet and not batch_files[0][-6:] == "_1.xml":
+            for rule_name, message in changes:
+                print "    {0}".format(message)
 
-                    issue.set("issueDate",
-                              issue_date.replace(bad_date, new_date))
 
-                    issue.text = issue.text.replace(bad_date_fd, new_date_fd)
+def fix_batch_dates(batch_path, batch_issues):
+    if not args.quiet:
+        print "\nFix dates in {0}".format(batch_path[len(search_dir):])
 
-            tree.write(batch_file, encoding="UTF-8", xml_declaration=True)
+    issue_edits = {}
+    for bdp, bad_date, new_date in batch_issues:
+        if not args.quiet:
+            print "\n  Search for bad dates in {0}".format(bdp[len(batch_path):])
+        if fix_dates(bdp, bad_date, new_date, pool):
+            issue_edits[os.path.relpath(bdp, batch_path)] = (bad_date, new_date)
+
+    if issue_edits:
+        update_batch_dates(batch_path, issue_edits)
 
 # Main
 # ----
 if  __name__ =='__main__':
-    print "Searching {0}".format(search_dir)
-    lccn_paths = find_lccn_paths()
+    if args.manifest:
+        corrections = load_manifest(args.manifest)
+    else:
+        try:
+            corrections = [(args.lccn, parse_date(args.bad_date),
+                            parse_date(args.new_date))]
+        except ValueError:
+            parser.error("bad_date and new_date must be YYYY-MM-DD")
 
-    for d in lccn_paths:
-        if not args.quiet:
-            print "\nSearch for bad dates in {0}".format(d[len(search_dir):])
-        bad_date_paths = find_bad_date_paths(d)
-
-        for bdp in bad_date_paths:
+    print "Searching {0}".format(search_dir)
+    batch_index = BatchIndex(search_dir, args.index_file)
+    batch_index.refresh()
+    if args.verbose:
+        print "  Listed {0} dirs, reused {1} from index".format(batch_index.dirs_listed, batch_index.dirs_reused)
+
+    # Group issues to fix by the batch holding their batch.xml
+    batch_work = {}
+    for lccn, bad_date, new_date in corrections:
+        for d in find_lccn_paths(batch_index, lccn):
             if not args.quiet:
-                print "\n  Search for bad dates in {0}".format(bdp[(len(search_dir) + len(d[len(search_dir):])):])
-            fix_dates(bdp)
-
+                print "\nSearch for bad date {0} in {1}".format(bad_date, d[len(search_dir):])
+            for bdp in find_bad_date_paths(batch_index, d, bad_date):
+                batch_path = os.path.dirname(d)
+                batch_work.setdefault(batch_path, []).append((bdp, bad_date, new_date))
+
+    # One engine holds the rules of every correction, so each issue file is
+    # parsed and written at most once however many corrections touch it
+    engine = RewriteEngine(dry_run=args.dry_run)
+    for lccn, bad_date, new_date in corrections:
+        engine.extend(date_rules(lccn, bad_date, new_date))
+
+    # Repair separate batches in worker processes, or with a single batch
+    # rewrite its files in worker processes instead
+    pool = None
+    batch_jobs = 1
+    if args.jobs > 1 and not args.dry_run:
+        if len(batch_work) > 1:
+            batch_jobs = args.jobs
+        else:
+            pool = multiprocessing.Pool(args.jobs)
+
+    failed = run_batches(fix_batch_dates, batch_work, batch_jobs,
+                         lock=not args.dry_run)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if failed:
+        sys.exit("Failed to repair {0} batches".format(len(failed)))
@@ -2,33 +2,29 @@
 
 import argparse
 from datetime import datetime
-import fileinput
 import glob
+import json
 import os
 import re
 import shutil
 import sys
 import time
-import xml.etree.ElementTree as ET
+import traceback
 
-# XML parser to retain comments
-class CommentRetainer(ET.XMLTreeBuilder):
-
-   def __init__(self):
-       ET.XMLTreeBuilder.__init__(self)
-       # assumes ElementTree 1.2.X
-       self._parser.CommentHandler = self.handle_comment
-
-   def handle_comment(self, data):
-       self._target.start(ET.Comment, {})
-       self._target.data(data)
-       self._target.end(ET.Comment)
+from batch_index import BatchIndex
+from batch_pool import run_batches
+from batchlib import MODS_IDENTIFIER, Issue, Reel
+from file_copy import COPY_STRATEGIES, copy_file
+from journal import Journal, JournalError
+from rewrite_rules import RewriteEngine, lccn_rules
+from xml_patch import patch_first_text
 
 
 
 # Defaults
 # --------
 search_dir = '/opt/openoni/data/batches'
+journal_file = '.fix_lccn_by_date.journal'
 
 
 
@@ -37,10 +33,30 @@ search_dir = '/opt/openoni/data/batches'
 parser = argparse.ArgumentParser()
 
 # Optional args
+parser.add_argument("-c", "--copy_strategy", choices=COPY_STRATEGIES,
+                    default="reflink",
+                    help="cheapest way to duplicate reel files, falling back "
+                         "to the next when unsupported (default: reflink)")
 parser.add_argument("-d", "--dry_run", action="store_true",
                     help="don't make any changes to preview outcome")
+parser.add_argument("-i", "--index_file",
+                    help="batch index file (default: <search_dir>/.batch_index.sqlite)")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="processes repairing separate batches (default: 1)")
+parser.add_argument("-l", "--journal",
+                    help="journal of completed steps (default: <search_dir>/.fix_lccn_by_date.journal)")
+parser.add_argument("-o", "--plan_file",
+                    help="write the planned changes as JSON (- for stdout)")
+parser.add_argument("-p", "--patch", action="store_true",
+                    help="splice the correct LCCN into METS XML bytes instead "
+                         "of rewriting the whole document")
 parser.add_argument("-q", "--quiet", action="store_true",
                     help="suppress output")
+parser.add_argument("-r", "--resume", action="store_true",
+                    help="resume an interrupted run from its journal")
+parser.add_argument("--restart", action="store_true",
+                    help="start a new run, discarding the journal of an "
+                         "unfinished one")
 parser.add_argument("-s", "--search_dir",
                     help="directory to search (default: /batches)")
 parser.add_argument("-v", "--verbose", action="store_true",
@@ -54,20 +70,30 @@ parser.add_argument("end_date", help="Ending date (YYYY-MM-DD), inclusive")
 
 args = parser.parse_args()
 
+if args.resume and args.restart:
+    parser.error("use only one of --resume and --restart")
 
 # Assign args
 bad_lccn = args.bad_lccn
 correct_lccn = args.correct_lccn
-start_date = args.start_date
-end_date = args.end_date
 
-bad_lccn_re = re.compile(bad_lccn)
+# Dates must parse as YYYY-MM-DD, or the issue range could silently
+# widen; strftime can't format years before 1900, so the file descriptor
+# naming format is built from the date's fields
+dates = []
+for name in ("start_date", "end_date"):
+    try:
+        dates.append(datetime.strptime(getattr(args, name), "%Y-%m-%d").date())
+    except ValueError:
+        parser.error("{0} must be YYYY-MM-DD".format(name))
+if dates[0] > dates[1]:
+    parser.error("start_date is after end_date")
+
+start_date, end_date = [date.isoformat() for date in dates]
+start_date_fd, end_date_fd = ["{0:04d}{1:02d}{2:02d}".format(
+    date.year, date.month, date.day) for date in dates]
 
-# Modify dates to file descriptor naming format
-start_date_fd = start_date.replace('-', '')
-start_date_re = re.compile(start_date_fd)
-end_date_fd = end_date.replace('-', '')
-end_date_re = re.compile(end_date_fd)
+bad_lccn_re = re.compile(bad_lccn)
 
 # Handle optional redefined batch directory
 if args.search_dir:
@@ -78,21 +104,12 @@ if args.search_dir:
 
 # Functions
 # ---------
-def find_effected_issue_paths(lccn_path):
-    effected_issue_paths = []
-
-    start_date_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    end_date_dt = datetime.strptime(end_date, "%Y-%m-%d")
+def find_effected_issue_paths(batch_index, lccn_path):
+    effected_issue_paths = batch_index.issues_between(lccn_path, start_date_fd, end_date_fd)
 
-    for root, dirs, files in os.walk(lccn_path):
-        for d in dirs:
-            if len(d) == 10:
-                d_dt = datetime.strptime(d[:8], "%Y%m%d")
-
-                if d_dt >= start_date_dt and d_dt <= end_date_dt:
-                    if args.verbose:
-                        print "  Dir {0} between {1} and {2}".format(d, start_date_fd, end_date_fd)
-                    effected_issue_paths.append(os.path.join(root, d))
+    if args.verbose:
+        for issue_path in effected_issue_paths:
+            print "  Dir {0} between {1} and {2}".format(os.path.basename(issue_path), start_date_fd, end_date_fd)
 
     if len(effected_issue_paths) == 0:
         print "\n  Could not find batches within effected dates inside LCCN dir\n   {0}".format(lccn_path[len(search_dir):])
@@ -100,15 +117,12 @@ def find_effected_issue_paths(lccn_path):
     return effected_issue_paths
 
 
-def find_lccn_paths():
-    lccn_paths = []
+def find_lccn_paths(batch_index):
+    lccn_paths = batch_index.lccn_paths(bad_lccn)
 
-    for root, dirs, files in os.walk(search_dir):
-        for d in dirs:
-            if d.find(bad_lccn) >= 0:
-                if args.verbose:
-                    print "  Found {0}".format((root + '/' + d)[len(search_dir):])
-                lccn_paths.append(os.path.join(root, d))
+    if args.verbose:
+        for d in lccn_paths:
+            print "  Found {0}".format(d[len(search_dir):])
 
     if len(lccn_paths) == 0:
         print "\n  Could not find batches identified by LCCN\n  {0}".format(bad_lccn)
@@ -116,227 +130,279 @@ def find_lccn_paths():
     return lccn_paths
 
 
-def fix_lccns(effected_issue_path):
-    for f in os.listdir(effected_issue_path):
-        if f.find('.xml') >= 0:
-            file_path = os.path.join(effected_issue_path, f)
-
-            alto_file = 0
-            alto_file_re = re.compile("[0-9]{4}\.xml")
-            if alto_file_re.match(f): alto_file = 1
-
-            # Don't replace lccn if a dry run
-            if not args.dry_run:
-                # Alto XML needs no changes
-
-                # Update METS XML
-                # ---------------
-                if not alto_file:
-                    if not args.quiet and not f[-6:] == "_1.xml":
-                        print "    Fix lccn in file {0}".format(f)
-
-                    # Set namespaces before parsing
-                    ET.register_namespace("", "http://www.loc.gov/METS/")
-                    ET.register_namespace("mix", "http://www.loc.gov/mix/")
-                    ET.register_namespace("ndnp", "http://www.loc.gov/ndnp")
-                    ET.register_namespace("premis", "http://www.oclc.org/premis")
-                    ET.register_namespace("mods", "http://www.loc.gov/mods/v3")
-                    ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
-                    ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
-                    ET.register_namespace("np", "urn:library-of-congress:ndnp:mets:newspaper")
-
-                    tree = ET.parse(file_path, parser=CommentRetainer())
-                    root = tree.getroot()
-
-                    # Set correct lccn in first mods:identifier element
-                    lccn_xml = root.find(".//{http://www.loc.gov/mods/v3}identifier")
-                    if not args.quiet and not f[-6:] == "_1.xml":
-                        print "      LCCN XML Identifier: {0}".format(lccn_xml.text)
-                    lccn_xml.text = correct_lccn
-
-                    tree.write(file_path, encoding="UTF-8",
-                               xml_declaration=True)
-
-                    # Restore structmap namespace that ET doesn't write
-                    file = fileinput.FileInput(file_path, inplace=1)
-                    for line in file:
-                        print line.replace('<structMap>', '<structMap xmlns:np="urn:library-of-congress:ndnp:mets:newspaper">'),
-
-                    fileinput.close()
-
-    # Move effected issue to path with correct lccn
-    # ---------------------------------------------
-    new_issue_path = bad_lccn_re.sub(correct_lccn, effected_issue_path)
-
-    if not args.quiet:
-        print "    Move {0} to {1}".format(bad_lccn, correct_lccn)
-
-    if not args.dry_run:
-        os.renames(effected_issue_path, new_issue_path)
+def plan_lccn_moves(batch_index):
+    # Work out every METS rewrite, issue move, reel copy, directory removal
+    # and batch XML edit from the batch index before anything changes
+    plan = []
+    batch_edits = {}
 
-    # Copy/delete reel files
-    # ----------------------
-    reel_path_re = re.compile('^(.+\/sn[0-9]+\/[0-9]{11})\/')
-    effected_reel_path = reel_path_re.match(effected_issue_path).group(1)
-    new_reel_path = reel_path_re.match(new_issue_path).group(1)
+    for lccn_path in find_lccn_paths(batch_index):
+        if not args.quiet:
+            print "\nSearch for effected issues in:\n{0}".format(lccn_path[len(search_dir):])
+        effected_issue_paths = find_effected_issue_paths(batch_index, lccn_path)
+        if not effected_issue_paths:
+            continue
+
+        batch_path = os.path.dirname(lccn_path)
+        new_lccn_path = os.path.join(batch_path, correct_lccn)
+        reels = batch_index.reels(lccn_path)
+        new_reels = set(batch_index.reels(new_lccn_path))
+        effected = set(effected_issue_paths)
+        reels_kept = len(reels)
+
+        # Last effected issue of each reel, after which the reel may go
+        issues = [Issue.from_path(issue_path) for issue_path in effected_issue_paths]
+        last_effected = {}
+        for issue in issues:
+            last_effected[issue.reel] = issue.path
 
-    reel_path_tail_re = re.compile('^.+\/(sn[0-9]+\/[0-9]{11})$')
-    effected_reel_path_tail = reel_path_tail_re.match(effected_reel_path).group(1)
-    new_reel_path_tail = reel_path_tail_re.match(new_reel_path).group(1)
-    reels_copied = []
-    reels_deleted = []
+        edits = batch_edits.setdefault(batch_path, {"op": "batch",
+                                                    "batch_path": batch_path,
+                                                    "issues": [],
+                                                    "reels_copied": [],
+                                                    "reels_deleted": []})
 
-    # Copy reel files to new lccn paths
-    if not os.path.exists(new_reel_path +'/'+ new_reel_path[-11:] +'.xml'):
-        if not args.quiet:
-            print "      Copy reel files from {0} to {1}".format(effected_reel_path_tail, new_reel_path_tail)
+        for issue in issues:
+            issue_path = issue.path
+            reel = Reel(batch_path, bad_lccn, issue.reel)
+            new_reel = Reel(batch_path, correct_lccn, issue.reel)
 
-        if not args.dry_run:
-            for file in glob.glob(effected_reel_path +'/*.*'):
-                shutil.copy2(file, new_reel_path)
-        reels_copied.append(new_reel_path_tail)
+            # Alto XML needs no changes
+            for mets_path in issue.mets_paths():
+                plan.append({"op": "rewrite", "issue": issue_path,
+                             "path": mets_path})
 
-    # Delete reel files if all issues moved to different lccn
-    for reel_path, reel_issues, _ in os.walk(effected_reel_path):
-        if len(reel_issues) == 0:
-            if not args.quiet:
-                print "      Delete reel files no longer needed from {0}".format(reel_path_tail_re.match(reel_path).group(1))
+            if reel.number not in new_reels:
+                plan.append({"op": "mkdir", "issue": issue_path,
+                             "path": new_reel.path})
+            plan.append({"op": "move", "issue": issue_path,
+                         "src": issue_path,
+                         "dst": os.path.join(new_reel.path, issue.name)})
 
-            if not args.dry_run:
-                shutil.rmtree(effected_reel_path)
-            reels_deleted.append(effected_reel_path_tail)
+            # Copy reel files to new lccn paths
+            if reel.number not in new_reels and \
+                    not os.path.exists(os.path.join(new_reel.path, reel.number + '.xml')):
+                plan.append({"op": "copy", "issue": issue_path,
+                             "src": reel.path, "dst": new_reel.path,
+                             "src_tail": reel.tail, "tail": new_reel.tail,
+                             "files": sorted(glob.glob(reel.path + '/*.*'))})
+                edits["reels_copied"].append(new_reel.tail)
+            new_reels.add(reel.number)
 
-            # Also remove lccn directory if empty now
-            lccn_path = effected_reel_path[:-12]
-            for lccn_path, lccn_reels, _ in os.walk(lccn_path):
-                if len(lccn_reels) == 0:
-                    print "        Delete emptied containing lccn directory"
+            # Delete reel files once all issues moved to different lccn, and
+            # the lccn directory with its last reel
+            if issue_path == last_effected[reel.number] and effected.issuperset(reels[reel.number]):
+                plan.append({"op": "rmtree", "issue": issue_path,
+                             "path": reel.path, "tail": reel.tail})
+                edits["reels_deleted"].append(reel.tail)
 
-                    if not args.dry_run:
-                        shutil.rmtree(lccn_path)
+                reels_kept -= 1
+                if not reels_kept:
+                    plan.append({"op": "rmtree", "issue": issue_path,
+                                 "path": lccn_path})
 
-                # Only check from top directory if empty
-                break
+            edits["issues"].append(issue.tail)
 
-        # Only check from top directory if issue subdirectories
-        break
+    for batch_path in sorted(batch_edits):
+        plan.append(batch_edits[batch_path])
 
-    # Update lccns and reels in batch(_1).xml files
-    # ---------------------------------------------
-    if not args.quiet:
-        print "    Update lccn in batch XML files to {0}".format(correct_lccn)
+    return plan
 
-    # Determine batch file and bad date paths
-    batch_path_re = re.compile('^(.+)\/sn[0-9]+\/')
-    batch_path = batch_path_re.match(effected_issue_path).group(1)
-    batch_files = [os.path.join(batch_path, "batch.xml"), os.path.join(batch_path, "batch_1.xml")]
 
-    effected_issue_path_tail_re = re.compile(".+\/({0}\/.+)$".format(bad_lccn))
-    effected_issue_path_tail = effected_issue_path_tail_re.match(effected_issue_path).group(1)
+# Field naming the target of each kind of planned operation
+plan_targets = {"rewrite": "path", "mkdir": "path", "move": "src",
+                "copy": "dst", "rmtree": "path", "batch": "batch_path"}
 
-    for batch_file in batch_files:
-        # Set namespaces before parsing
-        ET.register_namespace("", "http://www.loc.gov/ndnp")
-        ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
 
-        tree = ET.parse(batch_file, parser=CommentRetainer())
-        root = tree.getroot()
+def plan_step(op):
+    # Journal step name of a planned operation
+    return "{0} {1}".format(op["op"], op[plan_targets[op["op"]]])
 
-        # Iterate through issue elements to update lccns & paths
-        issues = root.findall(".//{http://www.loc.gov/ndnp}issue")
-        for issue in issues:
-            if issue.text.find(effected_issue_path_tail) >= 0:
-                issue_date = issue.get("issueDate")
-                issue_lccn = issue.get("lccn")
-                if not args.quiet and not batch_file[-6:] == "_1.xml":
-                    print "      Update issue {0} replacing {1} with {2}".format(issue_date, bad_lccn, correct_lccn)
 
-                issue.set("lccn", correct_lccn)
+def rewrite_mets_lccn(file_path):
+    f = os.path.basename(file_path)
+    if not args.quiet and not f[-6:] == "_1.xml":
+        print "    Fix lccn in file {0}".format(f)
 
-                issue.text = issue.text.replace(bad_lccn, correct_lccn)
+    # Patch the identifier text in place, keeping every other byte of the
+    # file, falling back to a full rewrite if it isn't plain text
+    if args.patch:
+        lccn_text = patch_first_text(file_path, MODS_IDENTIFIER, correct_lccn)
+        if lccn_text is not None:
+            if not args.quiet and not f[-6:] == "_1.xml":
+                print "      LCCN XML Identifier: {0}".format(lccn_text)
+            return
 
-        # Update reel elements
-        if len(reels_copied) or len(reels_deleted):
-            reels = root.findall(".//{http://www.loc.gov/ndnp}reel")
+    changes = engine.rewrite(file_path) or []
+    if not args.quiet and not f[-6:] == "_1.xml":
+        for rule_name, message in changes:
+            print "      {0}".format(message)
 
-            for reel_copied in reels_copied:
-                copied_reel_added = 0
-                copied_reel_number = int(reel_copied[-11:])
-                copied_reel_index = 0
-                reel_index = 0
 
-                for reel in reels:
-                    # Check if copied reel has already been added
-                    if (not copied_reel_added) and reel.text.find(reel_copied) >= 0:
-                        if args.verbose and not batch_file[-6:] == "_1.xml":
-                            print "      Copied reel {0} already added to batch XML".format(reel_copied)
+def plan_batch_path(op):
+    # Batch holding the file or directory a planned operation works on
+    if op["op"] == "batch":
+        return op["batch_path"]
+    return os.path.dirname(os.path.dirname(os.path.dirname(op["issue"])))
 
-                        copied_reel_added = 1
-                        break
 
-                    # Track where copied reel should be inserted
-                    if not copied_reel_index:
-                        reel_number = int(reel.text.split('/')[1])
+def execute_batch_plan(batch_path, batch_plan):
+    execute_plan(batch_plan, journal)
 
-                        if copied_reel_number < reel_number:
-                            copied_reel_index = len(issues) + reel_index
-                            break
 
-                        elif copied_reel_number == reel_number:
-                            # Compare lccn of copied reel
-                            if int(correct_lccn[2:]) < int(reel.text.split('/')[0][2:]):
-                                copied_reel_index = len(issues) + reel_index
-                                break
+def execute_plan(plan, journal):
+    # Apply planned operations in order, skipping those the journal records
+    # as done.  Dry runs only report what each operation would do.
+    issue_path = None
 
-                    reel_index += 1
+    for op in plan:
+        step = plan_step(op)
+        if journal.is_done(step):
+            continue
 
+        if op["op"] != "batch" and op["issue"] != issue_path:
+            issue_path = op["issue"]
+            if not args.quiet:
+                lccn_path = os.path.dirname(os.path.dirname(issue_path))
+                print "\n  Fix effected issue at {0}".format(issue_path[len(lccn_path):])
+
+        if op["op"] == "batch":
+            update_batch_lccns(op)
+            journal.complete(step)
+            continue
+
+        if op["op"] == "move" and not args.quiet:
+            print "    Move {0} to {1}".format(bad_lccn, correct_lccn)
+        elif op["op"] == "copy" and not args.quiet:
+            print "      Copy reel files from {0} to {1}".format(op["src_tail"], op["tail"])
+        elif op["op"] == "rmtree":
+            if "tail" in op:
+                if not args.quiet:
+                    print "      Delete reel files no longer needed from {0}".format(op["tail"])
+            else:
+                print "        Delete emptied containing lccn directory"
+
+        if args.dry_run:
+            continue
+
+        journal.begin(step)
+
+        if op["op"] == "rewrite":
+            rewrite_mets_lccn(op["path"])
+
+        elif op["op"] == "mkdir":
+            if not os.path.isdir(op["path"]):
+                os.makedirs(op["path"])
+
+        elif op["op"] == "move":
+            # A resumed run may find the issue already moved
+            if os.path.exists(op["src"]) or not os.path.exists(op["dst"]):
+                os.rename(op["src"], op["dst"])
+
+        elif op["op"] == "copy":
+            for file in op["files"]:
+                used = copy_file(file, op["dst"], args.copy_strategy)
+                if args.verbose:
+                    print "        {0} {1}".format(used, os.path.basename(file))
 
-                # Add copied reel to batch reels
-                if not copied_reel_added:
-                    if not args.quiet and not batch_file[-6:] == "_1.xml":
-                        print "      Adding copied reel {0} to batch XML".format(reel_copied)
+        elif op["op"] == "rmtree":
+            if os.path.exists(op["path"]):
+                shutil.rmtree(op["path"])
 
-                    reel_number = reel_copied.split('/')[1]
-                    reel_element = ET.Element("reel", {"reelNumber": reel_number})
-                    reel_element.text = reel_copied +'/'+ reel_number +'.xml' 
-                    reel_element.tail = '\n\t'
+        journal.complete(step)
 
-                    if copied_reel_index:
-                        root.insert(copied_reel_index, reel_element)
-                    else:
-                        root.append(reel_element)
 
+def update_batch_lccns(edits):
+    # Apply the lccn and reel updates planned for every issue moved in the
+    # batch, parsing and writing each batch(_1).xml file once
+    batch_path = edits["batch_path"]
+    if not args.quiet:
+        print "\n  Update lccn in batch XML files covering {0} to {1}".format(batch_path[len(search_dir):], correct_lccn)
 
-            for reel_deleted in reels_deleted:
-                deleted_reel_removed = 0
-                for reel in reels:
-                    # Check if deleted reels have been removed
-                    if (not deleted_reel_removed) and reel.text.find(reel_deleted) >= 0:
-                        if not args.quiet and not batch_file[-6:] == "_1.xml":
-                            print "      Removing deleted reel {0} found in batch XML".format(reel_deleted)
+    batch_engine = RewriteEngine(lccn_rules(bad_lccn, correct_lccn,
+                                            edits["issues"],
+                                            edits["reels_copied"],
+                                            edits["reels_deleted"]),
+                                 dry_run=args.dry_run)
 
-                        # Remove deleted reel from batch reels
-                        root.remove(reel)
-                        deleted_reel_removed = 1
+    # batch.xml and batch_1.xml share one tree when their contents match
+    results = batch_engine.rewrite_batch(batch_path)
+    if args.verbose and len(results) > 1:
+        print "    batch.xml and batch_1.xml differ, updating each separately"
 
-        if not args.dry_run:
-            tree.write(batch_file, encoding="UTF-8", xml_declaration=True)
+    for batch_files, changes in results:
+        if not args.quiet and not batch_files[0][-6:] == "_1.xml":
+            for rule_name, message in changes:
+                print "    {0}".format(message)
 
 # Main
 # ----
 if  __name__ =='__main__':
-    print "Searching for bad LCCN {0} in\n{1}".format(bad_lccn, search_dir)
-    lccn_paths = find_lccn_paths()
-
-    for d in lccn_paths:
-        if not args.quiet:
-            print "\nSearch for effected issues in:\n{0}".format(d[len(search_dir):])
-        effected_issue_paths = find_effected_issue_paths(d)
-
-        for eip in effected_issue_paths:
-            if not args.quiet:
-                print "\n  Fix effected issue at {0}".format(eip[(len(search_dir) + len(d[len(search_dir):])):])
-            fix_lccns(eip)
-
-    1
-
+    run_args = {"bad_lccn": bad_lccn, "correct_lccn": correct_lccn,
+                "start_date": start_date, "end_date": end_date,
+                "search_dir": search_dir}
+
+    # Dry runs change nothing, so there is nothing to journal
+    journal_path = args.journal or os.path.join(search_dir, journal_file)
+    try:
+        journal = Journal(None if args.dry_run else journal_path, args.resume,
+                          args.restart)
+    except JournalError as e:
+        sys.exit(e)
+
+    if args.resume and not args.dry_run:
+        if journal.start is None or journal.start["args"] != run_args:
+            sys.exit("Journal {0} was not started with these arguments".format(journal_path))
+        if journal.finished:
+            print "Journal {0} is already finished".format(journal_path)
+            sys.exit(0)
+
+        print "Resuming fix of bad LCCN {0} in\n{1}".format(bad_lccn, search_dir)
+        plan = journal.start["work"]
+
+    else:
+        print "Searching for bad LCCN {0} in\n{1}".format(bad_lccn, search_dir)
+        batch_index = BatchIndex(search_dir, args.index_file)
+        batch_index.refresh()
+        if args.verbose:
+            print "  Listed {0} dirs, reused {1} from index".format(batch_index.dirs_listed, batch_index.dirs_reused)
+        plan = plan_lccn_moves(batch_index)
+
+        journal.begin_run(run_args, plan)
+
+    if args.plan_file:
+        plan_out = sys.stdout if args.plan_file == "-" else open(args.plan_file, "w")
+        json.dump({"args": run_args, "plan": plan}, plan_out, indent=2, sort_keys=True)
+        plan_out.write("\n")
+        if plan_out is not sys.stdout:
+            plan_out.close()
+
+    # METS rules for every issue the plan moves, applied as each file's
+    # rewrite step runs
+    engine = RewriteEngine(dry_run=args.dry_run)
+    for op in plan:
+        if op["op"] == "batch":
+            engine.extend(lccn_rules(bad_lccn, correct_lccn, op["issues"]))
+
+    # Batches share no files, so each batch's part of the plan can run on
+    # its own, in order
+    batch_plans = {}
+    for op in plan:
+        batch_plans.setdefault(plan_batch_path(op), []).append(op)
+
+    # Without a pool a failed step raises here instead of being counted
+    try:
+        failed = run_batches(execute_batch_plan, batch_plans,
+                             1 if args.dry_run else args.jobs,
+                             lock=not args.dry_run)
+    except (Exception, KeyboardInterrupt):
+        journal.close()
+        traceback.print_exc()
+        sys.exit("Repair stopped, rerun with --resume")
+
+    if failed:
+        journal.close()
+        sys.exit("Failed to repair {0} batches, rerun with --resume".format(len(failed)))
+
+    journal.finish()
+    journal.close()
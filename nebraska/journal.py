@@ -0,0 +1,106 @@
+# Append-only journal of repair steps
+#
+# Long repair runs record each step before it starts ("plan") and after it
+# finishes ("done"), one JSON object per line.  A run interrupted partway
+# can then be resumed from the journal: completed steps are skipped and
+# the run's recorded start entry replaces rediscovering work in the tree.
+# A new run won't replace the journal of an unfinished one unless told to
+# restart, since steps left undone, such as the final batch XML edits,
+# would otherwise be lost.
+# Each entry is flushed as soon as it is written, and appended so entries
+# from processes sharing the journal don't overwrite each other.
+
+import json
+import os
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal(object):
+
+    def __init__(self, journal_path, resume=False, restart=False):
+        # A journal without a path records nothing, e.g. for dry runs
+        self.journal_path = journal_path
+        self.start = None
+        self.entries = []
+        self.started = set()
+        self.completed = set()
+        self.finished = False
+        self._file = None
+
+        if journal_path is None:
+            return
+
+        if resume:
+            if not os.path.exists(journal_path):
+                raise JournalError("no journal to resume at {0}".format(journal_path))
+            self.load()
+            self._file = open(journal_path, 'a')
+        else:
+            if not restart and os.path.exists(journal_path):
+                self.load()
+                if self.start is not None and not self.finished:
+                    raise JournalError("journal {0} records an unfinished run, "
+                                       "rerun with --resume to finish it or "
+                                       "--restart to discard it".format(journal_path))
+                self.start = None
+                self.entries = []
+                self.started = set()
+                self.completed = set()
+                self.finished = False
+            open(journal_path, 'w').close()
+            self._file = open(journal_path, 'a')
+
+    def load(self):
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partial last line from an interrupted write
+                    continue
+
+                if entry["op"] == "start":
+                    self.start = entry
+                elif entry["op"] == "plan":
+                    self.started.add(entry["step"])
+                elif entry["op"] == "done":
+                    self.completed.add(entry["step"])
+                elif entry["op"] == "finish":
+                    self.finished = True
+                self.entries.append(entry)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def record(self, entry):
+        if self._file:
+            self._file.write(json.dumps(entry, sort_keys=True) + "\n")
+            self._file.flush()
+
+    # Steps
+    # -----
+    def begin_run(self, run_args, work):
+        self.start = {"op": "start", "args": run_args, "work": work}
+        self.record(self.start)
+
+    def finish(self):
+        self.record({"op": "finish"})
+        self.finished = True
+
+    def begin(self, step, **details):
+        entry = dict(details, op="plan", step=step)
+        self.record(entry)
+        self.started.add(step)
+
+    def complete(self, step, **details):
+        entry = dict(details, op="done", step=step)
+        self.record(entry)
+        self.completed.add(step)
+
+    def is_done(self, step):
+        return step in self.completed
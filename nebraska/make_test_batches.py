@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+
+from batchlib import date_fd
+
+
+
+# Defaults
+# --------
+awardee = 'nbu'
+first_lccn = 84020109
+first_reel = 271740000
+title_names = ["Omaha daily bee", "Lincoln evening news", "Nebraska advertiser",
+               "Columbus journal", "Red Cloud chief", "Valentine democrat"]
+
+# Words drawn for OCR text, weighted toward the common ones as in real pages
+vocabulary = ("the of and to a in is that for it was on be with as by at this "
+              "from have not are but or his had they which their an one will "
+              "were county city street house council school railroad omaha "
+              "lincoln nebraska farmers cattle wheat corn bank court mayor "
+              "train depot weather church store sale price dollars").split()
+
+
+
+# Arguments
+# ---------
+parser = argparse.ArgumentParser(description="Write synthetic NDNP batches for "
+                                             "testing and timing the repair scripts")
+
+# Optional args
+parser.add_argument("-b", "--batches", type=int, default=2,
+                    help="batches to write (default: 2)")
+parser.add_argument("-d", "--start_date", default="1900-01-01",
+                    help="date of each title's first issue (default: 1900-01-01)")
+parser.add_argument("-i", "--issues", type=int, default=30,
+                    help="daily issues on each reel (default: 30)")
+parser.add_argument("-p", "--pages", type=int, default=4,
+                    help="pages in each issue (default: 4)")
+parser.add_argument("-q", "--quiet", action="store_true",
+                    help="suppress output")
+parser.add_argument("-r", "--reels", type=int, default=1,
+                    help="reels of each title in each batch (default: 1)")
+parser.add_argument("-S", "--seed", type=int, default=1,
+                    help="random seed, so the same arguments write the same files (default: 1)")
+parser.add_argument("-t", "--titles", type=int, default=2,
+                    help="titles (LCCNs) in each batch (default: 2)")
+parser.add_argument("-T", "--target_size", type=int, default=64,
+                    help="KB of each reel's target image (default: 64)")
+parser.add_argument("-w", "--words", type=int, default=1000,
+                    help="words on each ALTO page (default: 1000)")
+
+# Positional args
+parser.add_argument("output_dir", help="directory to write batches into, "
+                                       "which must not exist yet")
+
+args = parser.parse_args()
+
+try:
+    start_date = datetime.strptime(args.start_date, "%Y-%m-%d")
+except ValueError:
+    parser.error("start_date must be YYYY-MM-DD")
+
+if os.path.exists(args.output_dir):
+    parser.error("{0} already exists".format(args.output_dir))
+
+
+
+# Templates
+# ---------
+BATCH = u"""<?xml version="1.0" encoding="UTF-8"?>
+<batch xmlns="http://www.loc.gov/ndnp" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" name="{name}" awardee="{awardee}" awardYear="{year}" xsi:schemaLocation="http://www.loc.gov/ndnp http://www.loc.gov/standards/ndnp/schemas/batch.xsd">
+{issues}{reels}</batch>
+"""
+
+BATCH_ISSUE = u"""\t<issue lccn="{lccn}" issueDate="{date}" editionOrder="01">{lccn}/{reel}/{issue}/{issue}.xml</issue>\n"""
+
+BATCH_REEL = u"""\t<reel reelNumber="{reel}">{lccn}/{reel}/{reel}.xml</reel>\n"""
+
+REEL = u"""<?xml version="1.0" encoding="UTF-8"?>
+<mets xmlns="http://www.loc.gov/METS/" xmlns:mix="http://www.loc.gov/mix/" xmlns:ndnp="http://www.loc.gov/ndnp" xmlns:mods="http://www.loc.gov/mods/v3" xmlns:xlink="http://www.w3.org/1999/xlink" TYPE="urn:library-of-congress:ndnp:mets:newspaper:reel" PROFILE="urn:library-of-congress:mets:profiles:ndnp:reel:v1.1" LABEL="Microfilm reel {reel}">
+  <metsHdr CREATEDATE="{year}-01-01T00:00:00"><agent ROLE="CREATOR" TYPE="ORGANIZATION"><name>{awardee}</name></agent></metsHdr>
+  <dmdSec ID="reelModsBib"><mdWrap MDTYPE="MODS"><xmlData><mods:mods>
+    <mods:identifier type="reel number">{reel}</mods:identifier>
+  </mods:mods></xmlData></mdWrap></dmdSec>
+  <fileSec><fileGrp><file ID="targetFile1" USE="master"><FLocat LOCTYPE="OTHER" OTHERLOCTYPE="file" xlink:href="./{reel}_1.tif"/></file></fileGrp></fileSec>
+  <structMap><div TYPE="np:reel" DMDID="reelModsBib"><div TYPE="np:target"><fptr FILEID="targetFile1"/></div></div></structMap>
+</mets>
+"""
+
+METS = u"""<?xml version="1.0" encoding="UTF-8"?>
+<mets xmlns="http://www.loc.gov/METS/" xmlns:mix="http://www.loc.gov/mix/" xmlns:ndnp="http://www.loc.gov/ndnp" xmlns:premis="http://www.oclc.org/premis" xmlns:mods="http://www.loc.gov/mods/v3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xlink="http://www.w3.org/1999/xlink" TYPE="urn:library-of-congress:ndnp:mets:newspaper:issue" PROFILE="urn:library-of-congress:mets:profiles:ndnp:issue:v1.5" LABEL="{title}, {date}">
+  <!-- synthetic issue written by make_test_batches.py -->
+  <metsHdr CREATEDATE="{year}-01-01T00:00:00"><agent ROLE="CREATOR" TYPE="ORGANIZATION"><name>{awardee}</name></agent></metsHdr>
+  <dmdSec ID="issueModsBib">
+    <mdWrap MDTYPE="MODS" LABEL="Issue metadata">
+      <xmlData>
+        <mods:mods>
+          <mods:relatedItem type="host">
+            <mods:identifier type="lccn">{lccn}</mods:identifier>
+            <mods:part><mods:detail type="volume"><mods:number>{volume}</mods:number></mods:detail><mods:detail type="issue"><mods:number>{number}</mods:number></mods:detail><mods:detail type="edition"><mods:number>1</mods:number></mods:detail></mods:part>
+          </mods:relatedItem>
+          <mods:originInfo><mods:dateIssued encoding="iso8601">{date}</mods:dateIssued></mods:originInfo>
+          <mods:note type="agencyResponsible">{awardee}</mods:note>
+        </mods:mods>
+      </xmlData>
+    </mdWrap>
+  </dmdSec>
+{page_dmds}  <fileSec>
+{page_files}  </fileSec>
+  <structMap xmlns:np="urn:library-of-congress:ndnp:mets:newspaper">
+    <div TYPE="np:issue" DMDID="issueModsBib">
+{page_divs}    </div>
+  </structMap>
+</mets>
+"""
+
+METS_PAGE_DMD = u"""  <dmdSec ID="pageModsBib{n}"><mdWrap MDTYPE="MODS" LABEL="Page metadata"><xmlData><mods:mods><mods:part><mods:extent unit="pages"><mods:start>{n}</mods:start></mods:extent><mods:detail type="page number"><mods:number>{n}</mods:number></mods:detail></mods:part><mods:relatedItem type="original"><mods:physicalDescription><mods:form type="microfilm"/></mods:physicalDescription><mods:identifier type="reel number">{reel}</mods:identifier><mods:identifier type="reel sequence number">{n}</mods:identifier></mods:relatedItem></mods:mods></xmlData></mdWrap></dmdSec>
+"""
+
+METS_PAGE_FILES = u"""    <fileGrp ID="pageFileGrp{n}"><file ID="masterFile{n}" USE="master"><FLocat LOCTYPE="OTHER" OTHERLOCTYPE="file" xlink:href="./{page}.tif"/></file><file ID="serviceFile{n}" USE="service"><FLocat LOCTYPE="OTHER" OTHERLOCTYPE="file" xlink:href="./{page}.jp2"/></file><file ID="ocrFile{n}" USE="ocr"><FLocat LOCTYPE="OTHER" OTHERLOCTYPE="file" xlink:href="./{page}.xml"/></file></fileGrp>
+"""
+
+METS_PAGE_DIV = u"""      <div TYPE="np:page" DMDID="pageModsBib{n}"><fptr FILEID="masterFile{n}"/><fptr FILEID="serviceFile{n}"/><fptr FILEID="ocrFile{n}"/></div>
+"""
+
+ALTO_HEAD = u"""<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://schema.ccs-gmbh.com/ALTO" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://schema.ccs-gmbh.com/ALTO http://schema.ccs-gmbh.com/docworks/alto-1-4.xsd">
+<Description><MeasurementUnit>inch1200</MeasurementUnit><sourceImageInformation><fileName>./{page}.tif</fileName></sourceImageInformation></Description>
+<Layout><Page ID="P{n}" PHYSICAL_IMG_NR="{n}" HEIGHT="24000" WIDTH="18000"><PrintSpace ID="PS1" HPOS="0" VPOS="0" HEIGHT="24000" WIDTH="18000">
+"""
+
+ALTO_TAIL = u"""</PrintSpace></Page></Layout>
+</alto>
+"""
+
+ALTO_STRING = u"""<String ID="S{id}" HPOS="{hpos}" VPOS="{vpos}" HEIGHT="150" WIDTH="{width}" CONTENT="{content}" WC="{wc}"/>"""
+
+
+
+# Functions
+# ---------
+def write_file(path, text):
+    with open(path, "wb") as f:
+        f.write(text.encode("utf-8"))
+
+
+def alto_page(rng, page, n, date):
+    # Lines of about eight words, in blocks of about 20 lines, with the
+    # issue date on the first page's masthead as OCR reads it
+    parts = [ALTO_HEAD.format(page=page, n=n)]
+    words = []
+    if n == 1:
+        words.append(date)
+    words.extend(vocabulary[int(len(vocabulary) * rng.random() ** 2)]
+                 for _ in range(args.words - len(words)))
+
+    string_id = 0
+    for block_start in range(0, len(words), 160):
+        parts.append(u'<TextBlock ID="TB{0}">'.format(block_start // 160 + 1))
+        block = words[block_start:block_start + 160]
+        for line_start in range(0, len(block), 8):
+            vpos = 600 + (block_start + line_start) // 8 * 190
+            parts.append(u'<TextLine HPOS="900" VPOS="{0}" HEIGHT="150" WIDTH="16000">'.format(vpos))
+            hpos = 900
+            for word in block[line_start:line_start + 8]:
+                string_id += 1
+                width = 90 * len(word)
+                parts.append(ALTO_STRING.format(id=string_id, hpos=hpos, vpos=vpos,
+                                                width=width, content=word,
+                                                wc="0.{0:02d}".format(rng.randint(40, 99))))
+                parts.append(u'<SP HPOS="{0}" VPOS="{1}" WIDTH="60"/>'.format(hpos + width, vpos))
+                hpos += width + 60
+            parts.append(u'</TextLine>\n')
+        parts.append(u'</TextBlock>\n')
+
+    parts.append(ALTO_TAIL)
+    return u"".join(parts)
+
+
+def write_issue(rng, issue_path, title, lccn, reel, issue, date, number):
+    os.mkdir(issue_path)
+    pages = ["{0:04d}".format(n) for n in range(1, args.pages + 1)]
+
+    mets = METS.format(title=title, date=date, year=date[:4], awardee=awardee,
+                       lccn=lccn, volume=int(date[:4]) - 1870, number=number,
+                       page_dmds=u"".join(METS_PAGE_DMD.format(n=n, reel=reel)
+                                          for n in range(1, args.pages + 1)),
+                       page_files=u"".join(METS_PAGE_FILES.format(n=n, page=page)
+                                           for n, page in enumerate(pages, 1)),
+                       page_divs=u"".join(METS_PAGE_DIV.format(n=n)
+                                          for n in range(1, args.pages + 1)))
+    for name in (issue + ".xml", issue + "_1.xml"):
+        write_file(os.path.join(issue_path, name), mets)
+
+    for n, page in enumerate(pages, 1):
+        write_file(os.path.join(issue_path, page + ".xml"), alto_page(rng, page, n, date))
+        # Images are stand-ins, only their names matter to the scripts
+        write_file(os.path.join(issue_path, page + ".jp2"), u"")
+
+
+def write_reel(rng, reel_path, reel, year):
+    os.mkdir(reel_path)
+    reel_xml = REEL.format(reel=reel, year=year, awardee=awardee)
+    for name in (reel + ".xml", reel + "_1.xml"):
+        write_file(os.path.join(reel_path, name), reel_xml)
+
+    # Target bytes come from the seeded generator so output is repeatable
+    size = args.target_size * 1024
+    with open(os.path.join(reel_path, reel + "_1.tif"), "wb") as target:
+        target.write("{0:0{1}x}".format(rng.getrandbits(size * 8), size * 2).decode("hex"))
+
+
+def write_batch(rng, batch_number):
+    name = "batch_{0}_synth{1}".format(awardee, batch_number)
+    batch_path = os.path.join(args.output_dir, name, "data")
+    os.makedirs(batch_path)
+    issue_records = []
+    reel_records = []
+
+    for t in range(args.titles):
+        lccn = "sn{0}".format(first_lccn + t)
+        title = title_names[t % len(title_names)]
+        os.mkdir(os.path.join(batch_path, lccn))
+
+        # Each batch carries on from the dates the previous batch ended on
+        day = (batch_number - 1) * args.reels * args.issues
+        for r in range(args.reels):
+            reel_number = first_reel + ((batch_number - 1) * args.titles + t) * args.reels + r
+            reel = "{0:011d}".format(reel_number)
+            reel_path = os.path.join(batch_path, lccn, reel)
+            write_reel(rng, reel_path, reel, (start_date + timedelta(days=day)).year)
+            reel_records.append(BATCH_REEL.format(lccn=lccn, reel=reel))
+
+            for i in range(args.issues):
+                date = (start_date + timedelta(days=day)).date().isoformat()
+                issue = date_fd(date) + "01"
+                write_issue(rng, os.path.join(reel_path, issue), title, lccn,
+                            reel, issue, date, day + 1)
+                issue_records.append(BATCH_ISSUE.format(lccn=lccn, date=date,
+                                                        reel=reel, issue=issue))
+                day += 1
+
+    batch_xml = BATCH.format(name=name, awardee=awardee, year=start_date.year,
+                             issues=u"".join(issue_records),
+                             reels=u"".join(reel_records))
+    for batch_file in ("batch.xml", "batch_1.xml"):
+        write_file(os.path.join(batch_path, batch_file), batch_xml)
+
+    return batch_path
+
+
+# Main
+# ----
+if  __name__ =='__main__':
+    rng = random.Random(args.seed)
+
+    for batch_number in range(1, args.batches + 1):
+        batch_path = write_batch(rng, batch_number)
+        if not args.quiet:
+            print "Wrote {0}".format(batch_path)
+
+    if not args.quiet:
+        issues = args.batches * args.titles * args.reels * args.issues
+        print "{0} batches, {1} issues, {2} pages of {3} words".format(
+            args.batches, issues, issues * args.pages, args.words)
@@ -0,0 +1,299 @@
+# Declarative rewrites of NDNP batch files
+#
+# A fix to batch data is a set of rules, each naming the kind of file it
+# rewrites (issue METS, ALTO page or batch XML), a predicate on the file's
+# path, an element selector and a transform.  A RewriteEngine holds rules
+# from any number of fixes and applies every rule matching a file in one
+# pass, so each file is parsed and written at most once however many fixes
+# touch it, and not written at all when no rule changed it.
+#
+# METS and batch XML rules select elements with an ElementPath from the
+# root ("." for the root itself) and transform(element, context) returns a
+# message describing the change, or None when it changed nothing.  context
+# is a dict shared by the rules applied to one tree, holding "root".  ALTO
+# rules are streamed through alto_stream: their selector is a (within, tag,
+# attribute) triple and transform(value) returns the new value.
+
+import os
+import xml.etree.ElementTree as ET
+
+from alto_stream import file_contains, rewrite_attributes
+from batch_xml import ReelIndex, batch_file_groups, write_batch_files
+from batchlib import BATCH_FILES, BATCH_ISSUE, MODS_DATE_ISSUED, \
+    MODS_IDENTIFIER, batch_issue_tail, date_fd, is_alto_file, \
+    is_mets_file, parse_batch_xml, parse_mets, write_mets
+
+FILE_KINDS = ("mets", "alto", "batch")
+
+
+def file_kind(file_path):
+    name = os.path.basename(file_path)
+    if name in BATCH_FILES:
+        return "batch"
+    if is_alto_file(name):
+        return "alto"
+    if is_mets_file(name):
+        return "mets"
+    return None
+
+
+class Rule(object):
+
+    def __init__(self, name, kind, select, transform, applies=None,
+                 needle=None, limit=None):
+        # applies(file_path) limits the rule to some files of its kind, and
+        # needle is a byte string that must appear in a file for the rule to
+        # change it, letting files be skipped without parsing.  limit caps
+        # the number of selected elements transformed, e.g. 1 for the first.
+        if kind not in FILE_KINDS:
+            raise ValueError("unknown file kind {0}".format(kind))
+        self.name = name
+        self.kind = kind
+        self.select = select
+        self.transform = transform
+        self.applies = applies
+        self.needle = needle
+        self.limit = limit
+
+    def __repr__(self):
+        return "<Rule {0}>".format(self.name)
+
+    def matches(self, file_path):
+        return self.applies is None or self.applies(file_path)
+
+
+class RewriteEngine(object):
+
+    def __init__(self, rules=None, dry_run=False, ordered_attributes=False):
+        # ordered_attributes keeps METS attributes in document order, at the
+        # cost of parsing on the Python parser
+        self.rules = []
+        self.dry_run = dry_run
+        self.ordered_attributes = ordered_attributes
+        for rule in rules or []:
+            self.add(rule)
+
+    def add(self, rule):
+        self.rules.append(rule)
+
+    def extend(self, rules):
+        for rule in rules:
+            self.add(rule)
+
+    def rules_for(self, file_path, kind=None):
+        kind = kind or file_kind(file_path)
+        return [rule for rule in self.rules
+                if rule.kind == kind and rule.matches(file_path)]
+
+    def wanted(self, file_path, rules):
+        # Rules with needles apply only if their needle is in the file,
+        # searching the file once for each distinct needle
+        found = {None: True}
+        for rule in rules:
+            if rule.needle not in found:
+                found[rule.needle] = file_contains(file_path, rule.needle)
+        return [rule for rule in rules if found[rule.needle]]
+
+    # Files
+    # -----
+    def rewrite(self, file_path):
+        # Apply every matching rule to one issue file.  Returns the list of
+        # (rule name, message) changes, or None if no rule wanted the file.
+        kind = file_kind(file_path)
+        if kind == "batch":
+            raise ValueError("rewrite batch XML with rewrite_batch()")
+
+        rules = self.rules_for(file_path, kind)
+        if rules:
+            rules = self.wanted(file_path, rules)
+        if not rules:
+            return None
+
+        if kind == "alto":
+            return self.rewrite_alto(file_path, rules)
+
+        tree = parse_mets(file_path, self.ordered_attributes)
+        changes = self.apply(tree.getroot(), rules)
+        if changes and not self.dry_run:
+            write_mets(tree, file_path,
+                       sort_attributes=not self.ordered_attributes)
+        return changes
+
+    def rewrite_alto(self, file_path, rules):
+        stream_rules = [rule.select + (rule.transform,) for rule in rules]
+        if self.dry_run:
+            return []
+
+        replaced = rewrite_attributes(file_path, stream_rules)
+        return [(None, "Replaced {0} values".format(replaced))] if replaced else []
+
+    def rewrite_batch(self, batch_path):
+        # Apply batch XML rules to batch.xml and batch_1.xml, once for both
+        # when their contents match.  Returns [(batch files, changes)].
+        results = []
+
+        for batch_files in batch_file_groups(batch_path):
+            rules = self.rules_for(batch_files[0], "batch")
+            if not rules:
+                continue
+
+            tree = parse_batch_xml(batch_files[0])
+            changes = self.apply(tree.getroot(), rules)
+            if changes and not self.dry_run:
+                write_batch_files(tree, batch_files)
+            results.append((batch_files, changes))
+
+        return results
+
+    def apply(self, root, rules):
+        changes = []
+        context = {"root": root}
+
+        for rule in rules:
+            if rule.select == ".":
+                elements = [root]
+            else:
+                elements = root.findall(rule.select)
+            if rule.limit is not None:
+                elements = elements[:rule.limit]
+
+            for element in elements:
+                message = rule.transform(element, context)
+                if message is not None:
+                    changes.append((rule.name, message))
+
+        return changes
+
+
+# Date fix
+# --------
+def date_rules(lccn, bad_date, new_date, issue_tails=None):
+    # Rules replacing bad_date with new_date in the issue files of lccn
+    # issues dated bad_date, and in those issues' batch XML records, or
+    # only the records of lccn/reel/issue issue_tails if given
+    bad_date_fd = date_fd(bad_date)
+    if issue_tails is not None:
+        issue_tails = set(issue_tails)
+
+    def in_bad_issue(file_path):
+        issue_path = os.path.dirname(file_path)
+        lccn_path = os.path.dirname(os.path.dirname(issue_path))
+        return (os.path.basename(lccn_path) == lccn and
+                os.path.basename(issue_path).startswith(bad_date_fd))
+
+    def fix_label(root, context):
+        # Replace bad date in root's label attribute
+        label = root.get("LABEL")
+        if label is not None and label.find(bad_date) >= 0:
+            root.set("LABEL", label.replace(bad_date, new_date))
+            return "LABEL: {0}".format(label)
+
+    def fix_date_issued(date, context):
+        if date.text and date.text.find(bad_date) >= 0:
+            old_date = date.text
+            date.text = date.text.replace(bad_date, new_date)
+            return "dateIssued: {0}".format(old_date)
+
+    def replace_date(value):
+        if value.find(bad_date) >= 0:
+            return value.replace(bad_date, new_date)
+        return value
+
+    def fix_batch_issue(issue, context):
+        issue_path_tail = batch_issue_tail(issue)
+        if issue_tails is not None:
+            if issue_path_tail not in issue_tails:
+                return None
+        else:
+            issue_lccn, _, issue_name = issue_path_tail.split('/')
+            if issue_lccn != lccn or not issue_name.startswith(bad_date_fd):
+                return None
+
+        issue_date = issue.get("issueDate")
+        issue.set("issueDate", issue_date.replace(bad_date, new_date))
+        issue.text = issue.text.replace(bad_date_fd, date_fd(new_date))
+        return "Update issue {0} replacing {1} with {2}".format(issue_date, bad_date, new_date)
+
+    needle = bad_date.encode("utf-8")
+    return [
+        Rule("date-label", "mets", ".", fix_label, in_bad_issue, needle),
+        Rule("date-issued", "mets", ".//" + MODS_DATE_ISSUED, fix_date_issued,
+             in_bad_issue, needle, limit=1),
+        Rule("date-alto", "alto", ("PrintSpace", "String", "CONTENT"),
+             replace_date, in_bad_issue, needle),
+        Rule("date-batch", "batch", ".//" + BATCH_ISSUE, fix_batch_issue),
+    ]
+
+
+# LCCN fix
+# --------
+def lccn_rules(bad_lccn, correct_lccn, issue_tails, reels_copied=(),
+               reels_deleted=()):
+    # Rules setting correct_lccn in the METS of issues being moved from
+    # bad_lccn, whose lccn/reel/issue tails are issue_tails, and updating
+    # batch XML issue and reel records to match
+    issue_tails = set(issue_tails)
+
+    def in_moved_issue(file_path):
+        issue_path = os.path.dirname(file_path)
+        reel_path = os.path.dirname(issue_path)
+        tail = "{0}/{1}/{2}".format(os.path.basename(os.path.dirname(reel_path)),
+                                    os.path.basename(reel_path),
+                                    os.path.basename(issue_path))
+        return tail in issue_tails
+
+    def fix_identifier(identifier, context):
+        # Set correct lccn in first mods:identifier element
+        old_lccn = identifier.text
+        identifier.text = correct_lccn
+        return "LCCN XML Identifier: {0}".format(old_lccn)
+
+    def fix_batch_issue(issue, context):
+        if batch_issue_tail(issue) not in issue_tails:
+            return None
+
+        issue.set("lccn", correct_lccn)
+        issue.text = issue.text.replace(bad_lccn, correct_lccn)
+        return "Update issue {0} replacing {1} with {2}".format(issue.get("issueDate"), bad_lccn, correct_lccn)
+
+    def reel_index(context):
+        # Built once per tree and kept current by the reel rules
+        if "reel_index" not in context:
+            context["reel_index"] = ReelIndex(context["root"])
+        return context["reel_index"]
+
+    def add_reel(reel_copied):
+        def transform(root, context):
+            reels = reel_index(context)
+            if reels.find(reel_copied) is not None:
+                return None
+
+            reel_number = reel_copied.split('/')[1]
+            reel_element = ET.Element("reel", {"reelNumber": reel_number})
+            reel_element.text = reel_copied +'/'+ reel_number +'.xml'
+            reel_element.tail = '\n\t'
+            reels.insert(reel_element)
+            return "Adding copied reel {0} to batch XML".format(reel_copied)
+        return transform
+
+    def remove_reel(reel_deleted):
+        def transform(root, context):
+            reels = reel_index(context)
+            reel = reels.find(reel_deleted)
+            if reel is None:
+                return None
+
+            reels.remove(reel)
+            return "Removing deleted reel {0} found in batch XML".format(reel_deleted)
+        return transform
+
+    rules = [
+        Rule("lccn-identifier", "mets", ".//" + MODS_IDENTIFIER, fix_identifier,
+             in_moved_issue, limit=1),
+        Rule("lccn-batch", "batch", ".//" + BATCH_ISSUE, fix_batch_issue),
+    ]
+    for reel_copied in reels_copied:
+        rules.append(Rule("lccn-reel-copied", "batch", ".", add_reel(reel_copied)))
+    for reel_deleted in reels_deleted:
+        rules.append(Rule("lccn-reel-deleted", "batch", ".", remove_reel(reel_deleted)))
+    return rules
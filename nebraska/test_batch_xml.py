@@ -0,0 +1,129 @@
+# Tests for batch XML reel handling
+#
+# Run from this directory, so the bundled xml package is the one imported:
+#   python -m unittest test_batch_xml
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from batch_xml import ReelIndex
+from batchlib import BATCH_REEL, parse_batch_xml
+from rewrite_rules import RewriteEngine, lccn_rules
+
+
+# Reels grouped by title rather than sorted by (reel number, LCCN)
+UNSORTED_BATCH_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<batch xmlns="http://www.loc.gov/ndnp" name="batch_nbu_b1" awardee="nbu" awardYear="2012">
+\t<issue lccn="sn84020109" issueDate="1900-01-01" editionOrder="01">sn84020109/00271740002/1900010101/1900010101.xml</issue>
+\t<issue lccn="sn84020110" issueDate="1900-01-01" editionOrder="01">sn84020110/00271740001/1900010101/1900010101.xml</issue>
+\t<reel reelNumber="00271740002">sn84020109/00271740002/00271740002.xml</reel>
+\t<reel reelNumber="00271740004">sn84020109/00271740004/00271740004.xml</reel>
+\t<reel reelNumber="00271740001">sn84020110/00271740001/00271740001.xml</reel>
+\t<reel reelNumber="00271740005">sn84020110/00271740005/00271740005.xml</reel>
+</batch>
+"""
+
+SORTED_BATCH_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<batch xmlns="http://www.loc.gov/ndnp" name="batch_nbu_b1" awardee="nbu" awardYear="2012">
+\t<issue lccn="sn84020109" issueDate="1900-01-01" editionOrder="01">sn84020109/00271740002/1900010101/1900010101.xml</issue>
+\t<reel reelNumber="00271740001">sn84020110/00271740001/00271740001.xml</reel>
+\t<reel reelNumber="00271740002">sn84020109/00271740002/00271740002.xml</reel>
+\t<reel reelNumber="00271740005">sn84020110/00271740005/00271740005.xml</reel>
+</batch>
+"""
+
+
+def reel_texts(root):
+    return [reel.text.split('/')[0] + '/' + reel.get("reelNumber")
+            for reel in root.iter(BATCH_REEL)]
+
+
+def new_reel(reel_path_tail):
+    reel_number = reel_path_tail.split('/')[1]
+    reel = ET.Element(BATCH_REEL, {"reelNumber": reel_number})
+    reel.text = reel_path_tail + '/' + reel_number + '.xml'
+    return reel
+
+
+class ReelIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batch_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.batch_path)
+
+    def write_batch(self, batch_xml):
+        for name in ("batch.xml", "batch_1.xml"):
+            with open(os.path.join(self.batch_path, name), "w") as f:
+                f.write(batch_xml)
+
+    def parse(self, batch_xml):
+        self.write_batch(batch_xml)
+        return parse_batch_xml(os.path.join(self.batch_path, "batch.xml")).getroot()
+
+    def test_find_unsorted(self):
+        reels = ReelIndex(self.parse(UNSORTED_BATCH_XML))
+        self.assertFalse(reels.sorted)
+        for tail in ("sn84020109/00271740002", "sn84020109/00271740004",
+                     "sn84020110/00271740001", "sn84020110/00271740005"):
+            self.assertIsNotNone(reels.find(tail), tail)
+        self.assertIsNone(reels.find("sn84020110/00271740002"))
+
+    def test_remove_unsorted(self):
+        root = self.parse(UNSORTED_BATCH_XML)
+        reels = ReelIndex(root)
+        reels.remove(reels.find("sn84020110/00271740005"))
+        self.assertIsNone(reels.find("sn84020110/00271740005"))
+        self.assertEqual(reel_texts(root), ["sn84020109/00271740002",
+                                            "sn84020109/00271740004",
+                                            "sn84020110/00271740001"])
+
+    def test_insert_unsorted_after_lccn(self):
+        root = self.parse(UNSORTED_BATCH_XML)
+        reels = ReelIndex(root)
+        reels.insert(new_reel("sn84020109/00271740003"))
+        reels.insert(new_reel("sn84020111/00271740000"))
+        self.assertEqual(reel_texts(root), ["sn84020109/00271740002",
+                                            "sn84020109/00271740004",
+                                            "sn84020109/00271740003",
+                                            "sn84020110/00271740001",
+                                            "sn84020110/00271740005",
+                                            "sn84020111/00271740000"])
+        self.assertIsNotNone(reels.find("sn84020109/00271740003"))
+
+    def test_insert_sorted(self):
+        root = self.parse(SORTED_BATCH_XML)
+        reels = ReelIndex(root)
+        self.assertTrue(reels.sorted)
+        reels.insert(new_reel("sn84020109/00271740001"))
+        reels.insert(new_reel("sn84020110/00271740003"))
+        self.assertEqual(reel_texts(root), ["sn84020109/00271740001",
+                                            "sn84020110/00271740001",
+                                            "sn84020109/00271740002",
+                                            "sn84020110/00271740003",
+                                            "sn84020110/00271740005"])
+
+    def test_lccn_rules_unsorted(self):
+        # Moving reel 00271740002 to sn84020110 removes the old reel record
+        # and adds the copied one once, however often the rules run
+        self.write_batch(UNSORTED_BATCH_XML)
+        rules = lccn_rules("sn84020109", "sn84020110",
+                           ["sn84020109/00271740002/1900010101"],
+                           reels_copied=["sn84020110/00271740002"],
+                           reels_deleted=["sn84020109/00271740002"])
+        for run in range(2):
+            RewriteEngine(rules).rewrite_batch(self.batch_path)
+
+        root = parse_batch_xml(os.path.join(self.batch_path, "batch.xml")).getroot()
+        self.assertEqual(reel_texts(root), ["sn84020109/00271740004",
+                                            "sn84020110/00271740001",
+                                            "sn84020110/00271740005",
+                                            "sn84020110/00271740002"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Tests for batchlib's issue model and XML handling
+#
+# Run from this directory, so the bundled xml package is the one imported:
+#   python -m unittest test_batchlib
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import batchlib
+from batchlib import BATCH_NAMESPACES, METS_NAMESPACES, NDNP_NS, \
+    CommentRetainer, Issue, parse_mets, use_namespaces, write_mets
+
+
+METS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<mets xmlns="http://www.loc.gov/METS/" xmlns:mods="http://www.loc.gov/mods/v3" LABEL="Omaha daily bee, 1900-01-02">
+  <!-- generated -->
+  <dmdSec ID="issueModsBib">
+    <mods:identifier type="lccn">sn84020109</mods:identifier>
+  </dmdSec>
+  <structMap xmlns:np="urn:library-of-congress:ndnp:mets:newspaper">
+    <div TYPE="np:issue"><div TYPE="np:page"/></div>
+  </structMap>
+</mets>
+"""
+
+
+class IssueTest(unittest.TestCase):
+
+    def test_from_path(self):
+        issue = Issue.from_path("/batches/batch_nbu_b1/data/sn84020109/00271743567/1900010201")
+        self.assertEqual(issue.batch_path, "/batches/batch_nbu_b1/data")
+        self.assertEqual(issue.lccn, "sn84020109")
+        self.assertEqual(issue.reel, "00271743567")
+        self.assertEqual(issue.name, "1900010201")
+        self.assertEqual(issue.tail, "sn84020109/00271743567/1900010201")
+
+    def test_date_and_edition(self):
+        issue = Issue("/batches", "sn84020109", "00271743567", "1900010302")
+        self.assertEqual(issue.date, "1900-01-03")
+        self.assertEqual(issue.edition, 2)
+
+    def test_undated_issue(self):
+        issue = Issue("/batches", "sn84020109", "00271743567", "supplement")
+        self.assertIsNone(issue.date)
+        self.assertIsNone(issue.edition)
+
+
+class NamespaceTest(unittest.TestCase):
+
+    def test_use_namespaces_switches_tables(self):
+        issue = ET.Element("{%s}issue" % NDNP_NS)
+
+        use_namespaces(METS_NAMESPACES)
+        self.assertIs(batchlib._registered_namespaces[0], METS_NAMESPACES)
+        self.assertEqual(ET.tostring(issue),
+                         '<ndnp:issue xmlns:ndnp="%s" />' % NDNP_NS)
+
+        use_namespaces(BATCH_NAMESPACES)
+        self.assertIs(batchlib._registered_namespaces[0], BATCH_NAMESPACES)
+        self.assertEqual(ET.tostring(issue),
+                         '<issue xmlns="%s" />' % NDNP_NS)
+
+
+class MetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.mets_path = os.path.join(self.temp_dir, "1900010201.xml")
+        with open(self.mets_path, "w") as f:
+            f.write(METS_XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_mets(self):
+        with open(self.mets_path) as f:
+            return f.read()
+
+    def test_comment_retainer_round_trip(self):
+        for ordered_attributes in (False, True):
+            use_namespaces(METS_NAMESPACES)
+            tree = ET.parse(self.mets_path,
+                            parser=CommentRetainer(ordered_attributes=ordered_attributes))
+            written = ET.tostring(tree.getroot())
+            self.assertIn("<!-- generated -->", written)
+
+            root = ET.fromstring(written, parser=CommentRetainer())
+            self.assertIs(root[0].tag, ET.Comment)
+            self.assertEqual(root[0].text, " generated ")
+
+    def test_write_mets_pins_np_once(self):
+        write_mets(parse_mets(self.mets_path), self.mets_path)
+        written = self.read_mets()
+        self.assertEqual(written.count('xmlns:np="urn:library-of-congress:ndnp:mets:newspaper"'), 1)
+        self.assertIn('<structMap xmlns:np=', written)
+        self.assertIn("<!-- generated -->", written)
+
+    def test_write_mets_pins_np_once_in_document_order(self):
+        write_mets(parse_mets(self.mets_path, ordered_attributes=True),
+                   self.mets_path, sort_attributes=False)
+        self.assertEqual(self.read_mets().count("xmlns:np="), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -70,6 +70,8 @@ __all__ = [
     "VERSION",
     "XML",
     "XMLParser", "XMLTreeBuilder",
+    "CommentTreeBuilder",
+    "SerializationContext",
     ]
 
 VERSION = "1.3.0"
@@ -98,8 +100,11 @@ VERSION = "1.3.0"
 
 import sys
 import re
+import tempfile
 import warnings
 
+from collections import OrderedDict
+
 
 class _SimpleElementPath(object):
     # emulate pre-1.2 find/findtext/findall behaviour
@@ -150,7 +155,7 @@ class ParseError(SyntaxError):
 def iselement(element):
     # FIXME: not sure about this; might be a better idea to look
     # for tag/attrib/text attributes
-    return isinstance(element, Element) or hasattr(element, "tag")
+    return isinstance(element, _ElementInterface) or hasattr(element, "tag")
 
 ##
 # Element class.  This class defines the Element interface, and
@@ -783,13 +788,35 @@ class ElementTree(object):
     # @keyparam default_namespace Sets the default XML namespace (for "xmlns").
     # @keyparam method Optional output method ("xml", "html", "text" or
     #     "c14n"; default is "xml").
+    # @keyparam pinned_namespaces Optional mapping from element tags to
+    #     lists of namespace uri:s that are declared on every element with
+    #     that tag, even if no tag or attribute name in the tree uses them
+    #     (e.g. prefixes only referenced from attribute values).  Uri:s
+    #     already declared on the root element are not repeated.  Only used
+    #     by the "xml" method.
+    # @keyparam sort_attributes Write attributes in lexical order (default),
+    #     or if false in the order the elements store them, which for
+    #     elements parsed with ordered_attributes is document order.  Only
+    #     used by the "xml" method.
+    # @keyparam context Optional {@link #SerializationContext} to reuse
+    #     across writes.  Its default namespace is used, so a different
+    #     default_namespace can't also be given.  Only used by the "xml"
+    #     method.
+    # <p>
+    # The "xml" method holds its output back until the namespaces the tree
+    # uses are known, which is only once the whole tree has been walked.
+    # Up to about 1 MB is held in memory; output past that goes to a
+    # temporary file, which the write copies to the target at the end.
 
     def write(self, file_or_filename,
               # keyword arguments
               encoding=None,
               xml_declaration=None,
               default_namespace=None,
-              method=None):
+              method=None,
+              pinned_namespaces=None,
+              sort_attributes=True,
+              context=None):
         # assert self._root is not None
         if not method:
             method = "xml"
@@ -812,6 +839,16 @@ class ElementTree(object):
                 write("<?xml version='1.0' encoding='%s'?>\n" % encoding)
         if method == "text":
             _serialize_text(write, self._root, encoding)
+        elif method == "xml":
+            if context is None:
+                context = SerializationContext(default_namespace)
+            elif (default_namespace and
+                  default_namespace != context.default_namespace):
+                raise ValueError(
+                    "default_namespace differs from the context's"
+                    )
+            _serialize_xml(write, self._root, encoding, context,
+                           pinned_namespaces, sort_attributes)
         else:
             qnames, namespaces = _namespaces(
                 self._root, encoding, default_namespace
@@ -896,52 +933,270 @@ def _namespaces(elem, encoding, default_namespace=None):
             add_qname(text.text)
     return qnames, namespaces
 
-def _serialize_xml(write, elem, encoding, qnames, namespaces):
-    tag = elem.tag
-    text = elem.text
-    if tag is Comment:
-        write("<!--%s-->" % _encode(text, encoding))
-    elif tag is ProcessingInstruction:
-        write("<?%s?>" % _encode(text, encoding))
-    else:
-        tag = qnames[tag]
-        if tag is None:
-            if text:
-                write(_escape_cdata(text, encoding))
-            for e in elem:
-                _serialize_xml(write, e, encoding, qnames, None)
-        else:
-            write("<" + tag)
-            items = elem.items()
-            if items or namespaces:
-                if namespaces:
-                    for v, k in sorted(namespaces.items(),
-                                       key=lambda x: x[1]):  # sort on prefix
-                        if k:
-                            k = ":" + k
-                        write(" xmlns%s=\"%s\"" % (
-                            k.encode(encoding),
-                            _escape_attrib(v, encoding)
-                            ))
-                for k, v in sorted(items):  # lexical order
-                    if isinstance(k, QName):
-                        k = k.text
-                    if isinstance(v, QName):
-                        v = qnames[v.text]
+def _pinned_namespaces(pinned_namespaces, namespaces, encoding,
+                       registered):
+    # maps tags to the *encoded* namespace declarations pinned to them,
+    # leaving out uri:s declared on the root element
+    pinned = {}
+    for tag, uris in pinned_namespaces.items():
+        declarations = []
+        for uri in uris:
+            if uri in namespaces:
+                continue
+            prefix = registered.get(uri)
+            if prefix is None:
+                prefix = "ns%d" % (len(namespaces) + len(declarations))
+            declarations.append(" xmlns:%s=\"%s\"" % (
+                prefix.encode(encoding),
+                _escape_attrib(uri, encoding)
+                ))
+        if declarations:
+            pinned[tag] = "".join(declarations)
+    return pinned
+
+##
+# Reusable state for writing element trees as XML.  A context holds the
+# namespace prefixes registered when it is created, and the serialized
+# names worked out from them, which are kept from one write to the next.
+# Names are worked out the first time a write meets them, during the same
+# pass that writes the tree.  Create one for documents sharing a set of
+# namespaces and pass it to each {@link #ElementTree.write}.
+#
+# @param default_namespace Optional default XML namespace (for "xmlns").
+# @param namespaces Optional mapping from uri:s to prefixes, used instead
+#     of the namespaces registered with {@link #register_namespace}.
+# @see ElementTree#write
+
+class SerializationContext(object):
+
+    def __init__(self, default_namespace=None, namespaces=None):
+        if namespaces is None:
+            namespaces = _namespace_map
+        self.default_namespace = default_namespace
+        self.namespaces = dict(namespaces)
+        # maps encodings to qnames to (*encoded* name, uri, prefix), for
+        # the names that are written the same way in every document
+        self._names = {}
+
+    def _qname_table(self, encoding):
+        # the qname and namespace tables for one write, and a function
+        # adding a qname to them, which returns its *encoded* name
+        names = self._names.setdefault(encoding, {})
+        registered = self.namespaces
+        default_namespace = self.default_namespace
+
+        # maps qnames to *encoded* prefix:local names
+        qnames = {None: None}
+
+        # maps uri:s to prefixes
+        namespaces = {}
+        if default_namespace:
+            namespaces[default_namespace] = ""
+
+        def add_qname(qname):
+            key = qname
+            if isinstance(qname, QName):
+                qname = qname.text
+            elif not isinstance(qname, basestring):
+                _raise_serialization_error(qname)
+            cached = names.get(qname)
+            if cached is not None:
+                name, uri, prefix = cached
+            else:
+                try:
+                    if qname[:1] == "{":
+                        uri, tag = qname[1:].rsplit("}", 1)
+                        if uri == default_namespace:
+                            prefix = ""
+                        else:
+                            prefix = registered.get(uri)
+                        if prefix is None:
+                            # numbered in order of use in this document
+                            prefix = namespaces.get(uri)
+                            if prefix is None:
+                                prefix = "ns%d" % len(namespaces)
+                        if prefix:
+                            name = ("%s:%s" % (prefix, tag)).encode(encoding)
+                        else:
+                            name = tag.encode(encoding) # default element
                     else:
-                        v = _escape_attrib(v, encoding)
-                    write(" %s=\"%s\"" % (qnames[k], v))
-            if text or len(elem):
-                write(">")
-                if text:
-                    write(_escape_cdata(text, encoding))
-                for e in elem:
-                    _serialize_xml(write, e, encoding, qnames, None)
-                write("</" + tag + ">")
+                        if default_namespace:
+                            # FIXME: can this be handled in XML 1.0?
+                            raise ValueError(
+                                "cannot use non-qualified names with "
+                                "default_namespace option"
+                                )
+                        uri = prefix = None
+                        name = qname.encode(encoding)
+                except TypeError:
+                    _raise_serialization_error(qname)
+                if uri is None or uri == default_namespace or uri in registered:
+                    names[qname] = name, uri, prefix
+            if uri is not None and prefix != "xml":
+                namespaces[uri] = prefix
+            qnames[key] = qnames[qname] = name
+            return name
+
+        return qnames, namespaces, add_qname
+
+# number of output fragments collected before they're joined
+_SERIALIZE_CHUNK = 4096
+
+# number of joined chunks held in memory while the root's namespace
+# declarations are unknown, before the rest is spilled to a temporary file
+_SERIALIZE_HELD_CHUNKS = 32
+
+# size of each read when copying spilled output to the target
+_SPILL_COPY_SIZE = 64 * 1024
+
+def _serialize_xml(write, elem, encoding, context, pinned_namespaces=None,
+                   sort_attributes=True):
+    # walks the tree with an explicit stack instead of recursing, holding
+    # for each open element its remaining children, end tag and tail, and
+    # collects the output in large joined chunks instead of per fragment.
+    # Elements without children are written by the inner loop, which only
+    # breaks out to descend into an element.
+    #
+    # Names are worked out as the walk meets them, so the namespaces
+    # declared on the root element, and the pinned declarations that
+    # leave those out, are only known at the end.  Their places in the
+    # output are held by (tag, root) slots between the chunks, filled
+    # in before anything is written.  Up to _SERIALIZE_HELD_CHUNKS chunks
+    # are held in memory; past that, chunks go to a temporary file and
+    # slots are kept as offsets into it, so a large document costs disk
+    # space rather than memory the size of its output.
+    qnames, namespaces, add_qname = context._qname_table(encoding)
+    chunks = []
+    spill = None
+    data = []
+    append = data.append
+
+    def hold(chunk):
+        # keep a chunk or slot until the declarations are known
+        if spill is None:
+            chunks.append(chunk)
+        elif type(chunk) is tuple:
+            chunks.append((spill.tell(),) + chunk)
+        else:
+            spill.write(chunk)
+
+    root = True
+    stack = [(iter((elem,)), None, None)]
+    while stack:
+        children, end, tail = stack[-1]
+        for elem in children:
+            if len(data) >= _SERIALIZE_CHUNK:
+                hold("".join(data))
+                del data[:]
+                if spill is None and len(chunks) > _SERIALIZE_HELD_CHUNKS:
+                    # move the held chunks to the file, keeping the slots
+                    spill = tempfile.TemporaryFile()
+                    held, chunks = chunks, []
+                    for chunk in held:
+                        hold(chunk)
+                    del held
+            # only the root element declares namespaces
+            declare, root = root, False
+            tag = elem.tag
+            text = elem.text
+            if tag is Comment:
+                append("<!--%s-->" % _encode(text, encoding))
+            elif tag is ProcessingInstruction:
+                append("<?%s?>" % _encode(text, encoding))
             else:
-                write(" />")
-    if elem.tail:
-        write(_escape_cdata(elem.tail, encoding))
+                name = qnames.get(tag)
+                if name is None and tag is not None:
+                    name = add_qname(tag)
+                if name is None:
+                    if text:
+                        append(_escape_cdata(text, encoding))
+                    stack.append((iter(elem[:]), None, elem.tail))
+                    break
+                append("<" + name)
+                if declare or pinned_namespaces and tag in pinned_namespaces:
+                    hold("".join(data))
+                    del data[:]
+                    hold((tag, declare))
+                items = elem.items()
+                if items:
+                    if sort_attributes:
+                        items.sort()  # lexical order
+                    for k, v in items:
+                        k = qnames.get(k) or add_qname(k)
+                        if isinstance(v, QName):
+                            v = qnames.get(v.text) or add_qname(v.text)
+                        else:
+                            v = _escape_attrib(v, encoding)
+                        append(" %s=\"%s\"" % (k, v))
+                if len(elem):
+                    append(">")
+                    if text:
+                        append(_escape_cdata(text, encoding))
+                    stack.append((iter(elem[:]), "</" + name + ">", elem.tail))
+                    break
+                if text:
+                    append(">")
+                    append(_escape_cdata(text, encoding))
+                    append("</" + name + ">")
+                else:
+                    append(" />")
+            if elem.tail:
+                append(_escape_cdata(elem.tail, encoding))
+        else:
+            # all children written, close the element
+            stack.pop()
+            if end:
+                append(end)
+            if tail:
+                append(_escape_cdata(tail, encoding))
+    hold("".join(data))
+
+    # fill in the declarations, now the namespaces used are known
+    pinned = {}
+    if pinned_namespaces:
+        pinned = _pinned_namespaces(pinned_namespaces, namespaces, encoding,
+                                    context.namespaces)
+    declarations = []
+    for v, k in sorted(namespaces.items(),
+                       key=lambda x: x[1]):  # sort on prefix
+        if k:
+            k = ":" + k
+        declarations.append(" xmlns%s=\"%s\"" % (
+            k.encode(encoding),
+            _escape_attrib(v, encoding)
+            ))
+    declarations = "".join(declarations)
+
+    def declared(tag, declare):
+        chunk = pinned.get(tag, "")
+        if declare:
+            chunk += declarations
+        return chunk
+
+    if spill is None:
+        for chunk in chunks:
+            if type(chunk) is tuple:
+                chunk = declared(*chunk)
+            if chunk:
+                write(chunk)
+        return
+
+    # copy the spilled output, writing each slot's declarations at its
+    # offset
+    try:
+        end = spill.tell()
+        spill.seek(0)
+        position = 0
+        for offset, tag, declare in chunks + [(end, None, False)]:
+            while position < offset:
+                chunk = spill.read(min(_SPILL_COPY_SIZE, offset - position))
+                position += len(chunk)
+                write(chunk)
+            chunk = declared(tag, declare)
+            if chunk:
+                write(chunk)
+    finally:
+        spill.close()
 
 HTML_EMPTY = ("area", "base", "basefont", "br", "col", "frame", "hr",
               "img", "input", "isindex", "link", "meta", "param")
@@ -1058,36 +1313,149 @@ def _encode(text, encoding):
     except (TypeError, AttributeError):
         _raise_serialization_error(text)
 
+# byte strings without these characters are already escaped and encoded
+# for any of these encodings, found with a single scan
+_cdata_plain = re.compile("[&<>\x80-\xff]").search
+_attrib_plain = re.compile("[&<>\"\n\x80-\xff]").search
+_ascii_encodings = frozenset([
+    "us-ascii", "US-ASCII", "ascii", "utf-8", "UTF-8", "utf8",
+    "iso-8859-1", "ISO-8859-1", "latin-1",
+    ])
+
+##
+# Bounded memo of escaped and encoded values that needed escaping or
+# encoding, for values that repeat across a document.  New values go into
+# a recent generation; when that fills up it replaces the older
+# generation, so values used since the last turnover survive it.  This
+# approximates least-recently-used eviction without bookkeeping on every
+# hit.
+
+class _EscapeMemo(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def turnover(self):
+        self.older = self.recent
+        self.recent = {}
+        return self.recent
+
+    def clear(self):
+        self.recent = {}
+        self.older = {}
+        self.plain = self.hits = self.misses = 0
+
+# values per memo generation, and the longest value memoized
+_ESCAPE_MEMO_SIZE = 4096
+_ESCAPE_MEMO_LENGTH = 80
+
+# memo lookup default, as a memoized value may be empty
+_missing = object()
+
+_cdata_memo = _EscapeMemo(_ESCAPE_MEMO_SIZE)
+_attrib_memo = _EscapeMemo(_ESCAPE_MEMO_SIZE)
+
+##
+# Reports how often values were escaped by the plain fast path or found in
+# the escape memos.
+#
+# @param clear Reset the memos and their counters after reporting.
+# @return A dictionary mapping "cdata" and "attrib" to dictionaries of
+#     plain, hits, misses, size and hit_rate, the share of memo lookups
+#     that were hits.
+
+def escape_cache_info(clear=False):
+    info = {}
+    for name, memo in (("cdata", _cdata_memo), ("attrib", _attrib_memo)):
+        lookups = memo.hits + memo.misses
+        info[name] = {
+            "plain": memo.plain,
+            "hits": memo.hits,
+            "misses": memo.misses,
+            "size": len(memo.recent) + len(memo.older),
+            "hit_rate": float(memo.hits) / lookups if lookups else 0.0,
+            }
+        if clear:
+            memo.clear()
+    return info
+
 def _escape_cdata(text, encoding):
     # escape character data
+    memo = _cdata_memo
     try:
-        # it's worth avoiding do-nothing calls for strings that are
-        # shorter than 500 character, or so.  assume that's, by far,
-        # the most common case in most applications.
-        if "&" in text:
-            text = text.replace("&", "&amp;")
-        if "<" in text:
-            text = text.replace("<", "&lt;")
-        if ">" in text:
-            text = text.replace(">", "&gt;")
-        return text.encode(encoding, "xmlcharrefreplace")
+        if (type(text) is str and encoding in _ascii_encodings and
+            not _cdata_plain(text)):
+            memo.plain += 1
+            return text
+        key = text, encoding
+        escaped = memo.recent.get(key, _missing)
+        if escaped is not _missing:
+            memo.hits += 1
+            return escaped
+        # values found in the older generation move to the recent one
+        escaped = memo.older.get(key, _missing)
+        if escaped is not _missing:
+            memo.hits += 1
+        else:
+            memo.misses += 1
+            # it's worth avoiding do-nothing calls for strings that are
+            # shorter than 500 character, or so.  assume that's, by far,
+            # the most common case in most applications.
+            if "&" in text:
+                text = text.replace("&", "&amp;")
+            if "<" in text:
+                text = text.replace("<", "&lt;")
+            if ">" in text:
+                text = text.replace(">", "&gt;")
+            escaped = text.encode(encoding, "xmlcharrefreplace")
+            if len(text) > _ESCAPE_MEMO_LENGTH:
+                return escaped
+        recent = memo.recent
+        if len(recent) >= memo.size:
+            recent = memo.turnover()
+        recent[key] = escaped
+        return escaped
     except (TypeError, AttributeError):
         _raise_serialization_error(text)
 
 def _escape_attrib(text, encoding):
     # escape attribute value
+    memo = _attrib_memo
     try:
-        if "&" in text:
-            text = text.replace("&", "&amp;")
-        if "<" in text:
-            text = text.replace("<", "&lt;")
-        if ">" in text:
-            text = text.replace(">", "&gt;")
-        if "\"" in text:
-            text = text.replace("\"", "&quot;")
-        if "\n" in text:
-            text = text.replace("\n", "&#10;")
-        return text.encode(encoding, "xmlcharrefreplace")
+        if (type(text) is str and encoding in _ascii_encodings and
+            not _attrib_plain(text)):
+            memo.plain += 1
+            return text
+        key = text, encoding
+        escaped = memo.recent.get(key, _missing)
+        if escaped is not _missing:
+            memo.hits += 1
+            return escaped
+        # values found in the older generation move to the recent one
+        escaped = memo.older.get(key, _missing)
+        if escaped is not _missing:
+            memo.hits += 1
+        else:
+            memo.misses += 1
+            if "&" in text:
+                text = text.replace("&", "&amp;")
+            if "<" in text:
+                text = text.replace("<", "&lt;")
+            if ">" in text:
+                text = text.replace(">", "&gt;")
+            if "\"" in text:
+                text = text.replace("\"", "&quot;")
+            if "\n" in text:
+                text = text.replace("\n", "&#10;")
+            escaped = text.encode(encoding, "xmlcharrefreplace")
+            if len(text) > _ESCAPE_MEMO_LENGTH:
+                return escaped
+        recent = memo.recent
+        if len(recent) >= memo.size:
+            recent = memo.turnover()
+        recent[key] = escaped
+        return escaped
     except (TypeError, AttributeError):
         _raise_serialization_error(text)
 
@@ -1199,7 +1567,8 @@ def iterparse(source, events=None, parser=None):
         source = open(source, "rb")
         close_source = True
     if not parser:
-        parser = XMLParser(target=TreeBuilder())
+        # event reporting hooks into the Python parser's expat object
+        parser = _PyXMLParser(target=TreeBuilder())
     return _IterParseIterator(source, events, parser, close_source)
 
 class _IterParseIterator(object):
@@ -1439,6 +1808,43 @@ class TreeBuilder(object):
         self._tail = 1
         return self._last
 
+##
+# Tree builder target that also keeps comments, as {@link #Comment}
+# elements.  The comments are added through another builder's methods,
+# which are bound directly on this object, so with the C {@link
+# #XMLParser} and {@link #TreeBuilder} only the comments themselves pass
+# through Python code.
+#
+# @param builder Optional builder to add comments to.  If omitted, a new
+#     {@link #TreeBuilder} is used.
+# @keyparam ordered_attributes If true and the builder is omitted, use a
+#     TreeBuilder of Python elements, which keep attributes in the order
+#     an {@link #XMLParser} with ordered_attributes passes them.
+
+class CommentTreeBuilder(object):
+
+    def __init__(self, builder=None, ordered_attributes=False):
+        if builder is None:
+            if ordered_attributes:
+                builder = _PyTreeBuilder(_PyElement)
+            else:
+                builder = TreeBuilder()
+        self.builder = builder
+        self.start = builder.start
+        self.data = builder.data
+        self.end = builder.end
+        self.close = builder.close
+
+    ##
+    # Adds a comment to the current element.
+    #
+    # @param data The comment text.
+
+    def comment(self, data):
+        self.start(Comment, {})
+        self.data(data)
+        self.end(Comment)
+
 ##
 # Element structure builder for XML source data, based on the
 # <b>expat</b> parser.
@@ -1449,12 +1855,18 @@ class TreeBuilder(object):
 #     by the current implementation.
 # @keyparam encoding Optional encoding.  If given, the value overrides
 #     the encoding specified in the XML file.
+# @keyparam ordered_attributes Pass attributes to the target in
+#     OrderedDicts, in document order.  If the target is omitted, it is a
+#     TreeBuilder of Python elements, which keep that order; elements of
+#     the C {@link #TreeBuilder} don't.  Only the Python parser supports
+#     this, so it is used instead of the C parser.
 # @see #ElementTree
 # @see #TreeBuilder
 
 class XMLParser(object):
 
-    def __init__(self, html=0, target=None, encoding=None):
+    def __init__(self, html=0, target=None, encoding=None,
+                 ordered_attributes=False):
         try:
             from xml.parsers import expat
         except ImportError:
@@ -1466,12 +1878,16 @@ class XMLParser(object):
                     )
         parser = expat.ParserCreate(encoding, "}")
         if target is None:
-            target = TreeBuilder()
+            if ordered_attributes:
+                target = _PyTreeBuilder(_PyElement)
+            else:
+                target = TreeBuilder()
         # underscored names are provided for compatibility only
         self.parser = self._parser = parser
         self.target = self._target = target
         self._error = expat.error
         self._names = {} # name memo cache
+        self._attrib = OrderedDict if ordered_attributes else dict
         # callbacks
         parser.DefaultHandlerExpand = self._default
         parser.StartElementHandler = self._start
@@ -1527,7 +1943,7 @@ class XMLParser(object):
         fixname = self._fixname
         fixtext = self._fixtext
         tag = fixname(tag)
-        attrib = {}
+        attrib = self._attrib()
         for key, value in attrib_in.items():
             attrib[fixname(key)] = fixtext(value)
         return self.target.start(tag, attrib)
@@ -1536,7 +1952,7 @@ class XMLParser(object):
         fixname = self._fixname
         fixtext = self._fixtext
         tag = fixname(tag)
-        attrib = {}
+        attrib = self._attrib()
         if attrib_in:
             for i in range(0, len(attrib_in), 2):
                 attrib[fixname(attrib_in[i])] = fixtext(attrib_in[i+1])
@@ -1659,6 +2075,48 @@ class XMLParser(object):
 # compatibility
 XMLTreeBuilder = XMLParser
 
+# --------------------------------------------------------------------
+# C accelerator.  This package shadows the interpreter's xml package, so
+# importing xml.etree.ElementTree always finds this module.  Use the C
+# Element, SubElement, TreeBuilder and XMLParser from _elementtree when it
+# is available, keeping the Python implementations under _Py* names (and
+# XMLTreeBuilder, which can still be subclassed).  Set
+# sys.modules["_elementtree"] = None before the first import to stay with
+# the Python implementations.
+
+_PyElement = Element
+_PySubElement = SubElement
+_PyTreeBuilder = TreeBuilder
+_PyXMLParser = XMLParser
+
+def _accelerate():
+    # _elementtree imports this module as it initializes, which only works
+    # once the module is reachable from its package
+    package = sys.modules.get(__name__.rpartition(".")[0])
+    if package is not None:
+        setattr(package, __name__.rpartition(".")[2], sys.modules[__name__])
+    try:
+        import _elementtree
+    except ImportError:
+        return None
+    return _elementtree
+
+_elementtree = _accelerate()
+if _elementtree is not None:
+    Element = _elementtree.Element
+    SubElement = _elementtree.SubElement
+    TreeBuilder = _elementtree.TreeBuilder
+
+    def XMLParser(html=0, target=None, encoding=None,
+                  ordered_attributes=False):
+        # the C parser builds plain dicts of attributes, and takes a target
+        # of None as the target itself
+        if ordered_attributes:
+            return _PyXMLParser(html, target, encoding, ordered_attributes)
+        if target is None:
+            return _elementtree.XMLParser(encoding=encoding)
+        return _elementtree.XMLParser(target=target, encoding=encoding)
+
 # workaround circular import.
 try:
     from ElementC14N import _serialize_c14n
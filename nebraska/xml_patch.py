@@ -0,0 +1,89 @@
+# Byte-level patching of a single XML text node
+#
+# Changing one identifier in an issue METS file doesn't need the whole
+# document parsed into a tree and serialized again, which also normalizes
+# its declaration, namespace placement and quoting.  Expat reports the byte
+# offset of each event, so the text of the first matching element can be
+# located and the new text spliced into the original bytes, leaving every
+# other byte of the file as it was.
+
+import os
+import shutil
+import tempfile
+from xml.parsers import expat
+
+from alto_stream import escape_cdata
+
+
+class _Found(Exception):
+    pass
+
+
+def find_text_span(data, tag):
+    # Return (start, end, text) byte offsets of the first tag element's
+    # content, with tag in {namespace}local form, or None if the element is
+    # missing, empty or has children
+    parser = expat.ParserCreate(namespace_separator="}")
+    span = {}
+
+    def start(name, attrs):
+        if "start" in span:
+            # Child element inside the target
+            span["nested"] = True
+        elif "{" + name == tag or name == tag:
+            span["start"] = None
+            span["text"] = []
+
+    def data_handler(text):
+        if "start" in span:
+            if span["start"] is None:
+                span["start"] = parser.CurrentByteIndex
+            span["text"].append(text)
+
+    def end(name):
+        if "start" in span and ("{" + name == tag or name == tag):
+            span["end"] = parser.CurrentByteIndex
+            raise _Found()
+
+    parser.StartElementHandler = start
+    parser.CharacterDataHandler = data_handler
+    parser.EndElementHandler = end
+
+    try:
+        parser.Parse(data, 1)
+    except _Found:
+        pass
+
+    if "end" not in span or span["start"] is None or span.get("nested"):
+        return None
+    if data[span["end"]:span["end"] + 2] != b"</":
+        return None
+
+    return span["start"], span["end"], u"".join(span["text"])
+
+
+def patch_first_text(file_path, tag, new_text, encoding="utf-8"):
+    # Replace the text of the first tag element in file_path in place.
+    # Returns the old text, or None if the element couldn't be patched.
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    span = find_text_span(data, tag)
+    if span is None:
+        return None
+    start, end, old_text = span
+
+    patched = data[:start] + escape_cdata(new_text).encode(encoding) + data[end:]
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path),
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(patched)
+        shutil.copymode(file_path, temp_path)
+        os.rename(temp_path, file_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+    return old_text